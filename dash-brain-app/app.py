@@ -1,21 +1,38 @@
 from time import time
 import os
 import numpy as np
-import pandas as pd
-from nilearn import image
-from skimage import draw, filters, exposure, measure
-from scipy import ndimage
+from skimage import filters
 
 import plotly.graph_objects as go
 import plotly.express as px
 
 import dash
+import flask
 from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
 from dash import html
 from dash import dcc
-from dash_slicer import VolumeSlicer
 from chatbot_ai import get_ai_response
+from figure_codec import encode_trace
+from meshes import PendingMeshes, lesion_mesh, lesion_preview_mesh, load_skull_mesh
+from overlays import LazyOverlays, contour_traces, empty_overlay_data
+from patient_index import empty_patient_data, load_patient_index
+from roi_histogram import load_histogram_index, roi_histogram
+from roi_mask import RoiMasks
+from segmentation import LESION_SMOOTH_FOOTPRINT, SegmentationSessions
+from slice_pyramid import PyramidVolumeSlicer, SlicePyramids
+from slice_tiles import TILE_FORMATS, TILE_LEVELS, SliceTiles, tile_etag
+from volume_cache import (
+    DATASET_DIR,
+    DEFAULT_IMAGE_NAME,
+    load_histogram,
+    load_image,
+    load_lesion_mask,
+    load_smoothed,
+    require_verified_dataset,
+)
+from volume_store import Volume, VolumeStore
+from windowing import BRAIN_WINDOW, WINDOW_PRESETS, window_bounds
 
 # Bootstrap 스타일시트 설정
 external_stylesheets = [dbc.themes.BOOTSTRAP]
@@ -143,217 +160,52 @@ t1 = time()
 
 # ------------- 데이터셋 관리 ---------------------------------------------------
 
-# 데이터셋 경로 설정
-DATASET_DIR = "../dash-brain-ct-data"  # 올바른 상대 경로로 수정
-DEFAULT_IMAGE = "assets/sample_brain_ct.nii"  # 기본 뇌 CT 이미지로 변경
+# true이면 시작할 때 SHA256SUMS.txt로 데이터셋을 검증하고, 다른 파일이 있으면 시작하지 않음
+# (검증 상태 파일 덕분에 바뀐 파일만 다시 해시)
+if os.environ.get("REQUIRE_VERIFIED_DATASET", "False").lower() == "true":
+    require_verified_dataset()
+
+# 환자 메타데이터 인덱스 (두 CSV를 프로세스 시작 시 한 번만 읽음)
+patient_index = load_patient_index(DATASET_DIR)
 
 # 사용 가능한 이미지 파일 목록 가져오기
 def get_available_images():
+    # CT 스캔 폴더에서 이미지 파일 검색
+    ct_scans_dir = os.path.join(DATASET_DIR, "ct_scans")
+    if not os.path.exists(ct_scans_dir):
+        # 기본 이미지만 반환
+        return [{'label': DEFAULT_IMAGE_NAME, 'value': DEFAULT_IMAGE_NAME}]
+
+    image_files = [f for f in os.listdir(ct_scans_dir)
+                   if f.lower().endswith(('.nii', '.nii.gz'))]
+    # 숫자 순으로 정렬
+    image_files.sort(key=lambda x: int(x.split('.')[0]))
+
     images = []
-    
-    if os.path.exists(DATASET_DIR):
-        # CT 스캔 폴더에서 이미지 파일 검색
-        ct_scans_dir = os.path.join(DATASET_DIR, "ct_scans")
-        if os.path.exists(ct_scans_dir):
-            image_files = [f for f in os.listdir(ct_scans_dir) 
-                          if f.lower().endswith(('.nii', '.nii.gz'))]
-            # 숫자 순으로 정렬
-            image_files.sort(key=lambda x: int(x.split('.')[0]))
-            
-            # 메타데이터 로드 (환자 정보 포함)
-            metadata_path = os.path.join(DATASET_DIR, "Patient_demographics.csv")
-        if os.path.exists(metadata_path):
-            try:
-                    # CSV 파일의 헤더가 두 줄로 되어 있으므로 수동으로 컬럼명 지정
-                    metadata = pd.read_csv(metadata_path, skiprows=1)  # 첫 번째 헤더 줄 건너뛰기
-                    metadata.columns = [
-                        'Patient_Number', 'Age', 'Gender', 'Intraventricular', 
-                        'Intraparenchymal', 'Subarachnoid', 'Epidural', 'Subdural', 
-                        'Fracture', 'Note1'
-                    ]
-                    # 각 파일에 대해 환자 정보와 함께 표시
-                    for img_file in image_files:
-                        patient_num = int(img_file.split('.')[0])
-                        # 환자 정보 찾기
-                        patient_info = metadata[metadata['Patient_Number'] == patient_num]
-                        if not patient_info.empty:
-                            row = patient_info.iloc[0]
-                            age = int(float(row['Age'])) if pd.notna(row['Age']) and str(row['Age']).replace('.', '').replace('-', '').isdigit() else '알수없음'
-                            gender = row['Gender'] if pd.notna(row['Gender']) else '알수없음'
-                            # 출혈 타입 확인
-                            hemorrhage_types = []
-                            if pd.notna(row.get('Intraventricular')) and row.get('Intraventricular') == 1:
-                                hemorrhage_types.append('뇌실내출혈')
-                            if pd.notna(row.get('Intraparenchymal')) and row.get('Intraparenchymal') == 1:
-                                hemorrhage_types.append('뇌실질내출혈')
-                            if pd.notna(row.get('Subarachnoid')) and row.get('Subarachnoid') == 1:
-                                hemorrhage_types.append('지주막하출혈')
-                            if pd.notna(row.get('Epidural')) and row.get('Epidural') == 1:
-                                hemorrhage_types.append('경막외출혈')
-                            if pd.notna(row.get('Subdural')) and row.get('Subdural') == 1:
-                                hemorrhage_types.append('경막하출혈')
-                            
-                            hemorrhage_str = ', '.join(hemorrhage_types) if hemorrhage_types else '정상'
-                            label = f"환자 {patient_num} (나이 : {age}세, 성별 : {gender}, 진단 : {hemorrhage_str})"
-                        else:
-                            label = f"환자 {patient_num} (정보없음)"
-                        
-                        images.append({'label': label, 'value': img_file})
-                    
-                    return images
-                    
-            except Exception as e:
-                print(f"메타데이터 로드 오류: {e}")
-                    # 메타데이터 로드 실패 시 파일명만 사용
-                return [{'label': f"환자 {f.split('.')[0]}", 'value': f} for f in image_files]
-            else:
-                # 메타데이터 파일이 없는 경우
-                return [{'label': f"환자 {f.split('.')[0]}", 'value': f} for f in image_files]
-    
-    # 기본 이미지만 반환
-    return [{'label': "기본 뇌 CT 샘플 이미지 (NII)", 'value': "기본 뇌 CT 샘플 이미지 (NII)"}]
+    for img_file in image_files:
+        patient_num = int(img_file.split('.')[0])
+        # 메타데이터 로드 실패 시 파일명만 사용
+        label = patient_index.dropdown_label(patient_num) if patient_index else f"환자 {patient_num}"
+        images.append({'label': label, 'value': img_file})
+    return images
 
 available_images = get_available_images()
 
-# 이미지 로드 함수
-def load_image(image_name):
-    try:
-        if image_name == "기본 뇌 CT 샘플 이미지 (NII)":
-            img = image.load_img(DEFAULT_IMAGE)
-        else:
-            img_path = os.path.join(DATASET_DIR, "ct_scans", image_name)
-            print(f"🔄 이미지 로드 중: {img_path}")
-            img = image.load_img(img_path)
-        
-        mat = img.affine
-        img = img.get_fdata()
-        img = np.copy(np.moveaxis(img, -1, 0))[:, ::-1]
-        spacing = abs(mat[2, 2]), abs(mat[1, 1]), abs(mat[0, 0])
-        print(f"이미지 크기: {img.shape}, 스페이싱: {spacing}")
-        return img, spacing
-    except Exception as e:
-        print(f"이미지 로드 오류: {e}")
-        # 기본 이미지로 폴백
-        img = image.load_img(DEFAULT_IMAGE)
-        mat = img.affine
-        img = img.get_fdata()
-        img = np.copy(np.moveaxis(img, -1, 0))[:, ::-1]
-        spacing = abs(mat[2, 2]), abs(mat[1, 1]), abs(mat[0, 0])
-        return img, spacing
-
 # 환자 정보를 가져오는 함수 추가
 def get_patient_info(image_name):
     """선택된 이미지 파일명으로부터 환자 정보를 가져옵니다."""
-    if image_name == "기본 뇌 CT 샘플 이미지 (NII)":
-        return {
-            'patient_num': '샘플',
-            'age': '알수없음',
-            'gender': '알수없음',
-            'hemorrhage_types': [],
-            'fracture': False,
-            'note': '기본 샘플 이미지입니다.',
-            'detailed_diagnosis': {},
-            'total_slices': 0,
-            'affected_slices': 0
-        }
-    
+    if image_name == DEFAULT_IMAGE_NAME:
+        return empty_patient_data('샘플', note='기본 샘플 이미지입니다.')
+
     try:
         patient_num = int(image_name.split('.')[0])
-        
-        # 기본 환자 정보 로드
-        demographics_path = os.path.join(DATASET_DIR, "Patient_demographics.csv")
-        detailed_diagnosis_path = os.path.join(DATASET_DIR, "hemorrhage_diagnosis_raw_ct.csv")
-        
-        patient_data = {
-            'patient_num': patient_num,
-            'age': '알수없음',
-            'gender': '알수없음',
-            'hemorrhage_types': [],
-            'fracture': False,
-            'note': '',
-            'detailed_diagnosis': {},
-            'total_slices': 0,
-            'affected_slices': 0
-        }
-        
-        # 기본 환자 정보 로드
-        if os.path.exists(demographics_path):
-            # CSV 파일의 헤더가 두 줄로 되어 있으므로 수동으로 컬럼명 지정
-            demographics = pd.read_csv(demographics_path, skiprows=1)  # 첫 번째 헤더 줄 건너뛰기
-            demographics.columns = [
-                'Patient_Number', 'Age', 'Gender', 'Intraventricular', 
-                'Intraparenchymal', 'Subarachnoid', 'Epidural', 'Subdural', 
-                'Fracture', 'Note1'
-            ]
-            patient_info = demographics[demographics['Patient_Number'] == patient_num]
-            
-            if not patient_info.empty:
-                row = patient_info.iloc[0]
-                patient_data['age'] = int(float(row['Age'])) if pd.notna(row['Age']) and str(row['Age']).replace('.', '').replace('-', '').isdigit() else '알수없음'
-                patient_data['gender'] = row['Gender'] if pd.notna(row['Gender']) else '알수없음'
-                patient_data['fracture'] = bool(pd.notna(row.get('Fracture')) and row.get('Fracture') == 1)
-                patient_data['note'] = row.get('Note1') if pd.notna(row.get('Note1')) else ''
-                
-                # 출혈 타입 확인 (기본 정보) - 올바른 컬럼명 사용
-                if pd.notna(row.get('Intraventricular')) and row.get('Intraventricular') == 1:
-                    patient_data['hemorrhage_types'].append('뇌실내출혈')
-                if pd.notna(row.get('Intraparenchymal')) and row.get('Intraparenchymal') == 1:
-                    patient_data['hemorrhage_types'].append('뇌실질내출혈')
-                if pd.notna(row.get('Subarachnoid')) and row.get('Subarachnoid') == 1:
-                    patient_data['hemorrhage_types'].append('지주막하출혈')
-                if pd.notna(row.get('Epidural')) and row.get('Epidural') == 1:
-                    patient_data['hemorrhage_types'].append('경막외출혈')
-                if pd.notna(row.get('Subdural')) and row.get('Subdural') == 1:
-                    patient_data['hemorrhage_types'].append('경막하출혈')
-        
-        # 상세 진단 정보 로드 (슬라이스별)
-        if os.path.exists(detailed_diagnosis_path):
-            detailed_data = pd.read_csv(detailed_diagnosis_path)
-            patient_slices = detailed_data[detailed_data['PatientNumber'] == patient_num]
-            
-            if not patient_slices.empty:
-                patient_data['total_slices'] = len(patient_slices)
-                
-                # 각 출혈 타입별 영향받은 슬라이스 수 계산
-                hemorrhage_columns = ['Intraventricular', 'Intraparenchymal', 'Subarachnoid', 'Epidural', 'Subdural']
-                hemorrhage_names = ['뇌실내출혈', '뇌실질내출혈', '지주막하출혈', '경막외출혈', '경막하출혈']
-                
-                for col, name in zip(hemorrhage_columns, hemorrhage_names):
-                    affected_count = len(patient_slices[patient_slices[col] == 1])
-                    if affected_count > 0:
-                        patient_data['detailed_diagnosis'][name] = {
-                            'affected_slices': affected_count,
-                            'percentage': round((affected_count / patient_data['total_slices']) * 100, 1),
-                            'slice_range': patient_slices[patient_slices[col] == 1]['SliceNumber'].tolist()
-                        }
-                
-                # 전체 영향받은 슬라이스 수 (출혈이 있는 슬라이스)
-                patient_data['affected_slices'] = len(patient_slices[patient_slices['No_Hemorrhage'] == 0])
-                
-                # 골절 정보 (슬라이스별)
-                fracture_slices = len(patient_slices[patient_slices['Fracture_Yes_No'] == 1])
-                if fracture_slices > 0:
-                    patient_data['fracture_details'] = {
-                        'affected_slices': fracture_slices,
-                        'percentage': round((fracture_slices / patient_data['total_slices']) * 100, 1)
-                    }
-        
-        return patient_data
-            
+        if patient_index is not None:
+            return patient_index.get(patient_num)
+        return empty_patient_data(patient_num)
     except Exception as e:
         print(f"환자 정보 로드 오류: {e}")
-    
-    return {
-        'patient_num': '알수없음',
-        'age': '알수없음',
-        'gender': '알수없음',
-        'hemorrhage_types': [],
-        'fracture': False,
-        'note': '',
-        'detailed_diagnosis': {},
-        'total_slices': 0,
-        'affected_slices': 0
-    }
+
+    return empty_patient_data()
 
 def calculate_smart_axial_recommendation(detailed_diagnosis):
     """출혈 타입별 중요도와 영향 범위를 고려한 스마트한 축방향 추천 위치 계산"""
@@ -456,72 +308,151 @@ def calculate_smart_sagittal_recommendation(detailed_diagnosis, patient_data, im
         print(f"시상면 추천 계산 오류: {e}")
         return img_width // 2  # 오류 시 기본값 반환
 
+def load_volume(image_name):
+    """이미지를 로드하고 평활화된 볼륨을 함께 만들어 반환합니다."""
+    img, spacing = load_image(image_name)
+    # Create smoothed image (스캔당 한 번 계산 후 디스크 캐시에서 재사용)
+    med_img = load_smoothed(image_name, img)
+    roi_histograms = load_histogram_index(image_name, med_img)
+    lesion_mask = load_lesion_mask(image_name)
+    return Volume(name=image_name, img=img, med_img=med_img, spacing=spacing,
+                  roi_histograms=roi_histograms, lesion_mask=lesion_mask)
+
+# 이미지 이름별 볼륨 LRU 저장소 (워커 내 모든 세션이 공유, 바이트 상한)
+volume_store = VolumeStore(
+    load_volume,
+    max_bytes=int(os.environ.get("VOLUME_CACHE_MAX_BYTES", 1 << 30)),
+)
+
+def get_volume(volume_key):
+    """세션의 volume-key 값으로 볼륨을 조회합니다."""
+    return volume_store.get(volume_key or DEFAULT_IMAGE_NAME)
+
 # 기본 이미지 로드
-img, spacing = load_image("기본 뇌 CT 샘플 이미지 (NII)")
+default_volume = get_volume(DEFAULT_IMAGE_NAME)
+img, spacing, med_img = default_volume.img, default_volume.spacing, default_volume.med_img
 
 # 이미지 처리
-# Create smoothed image and histogram
-med_img = filters.median(img, footprint=np.ones((1, 3, 3), dtype=bool))
-hi = exposure.histogram(med_img)
+# Create histogram (스캔별 캐시)
+hi = load_histogram(default_volume.name, med_img)
 
 # 슬라이스 중앙 위치 계산
 axial_center = img.shape[0] // 2
 sagittal_center = img.shape[1] // 2
 
-# Create mesh
-try:
-    # 최신 버전 API 시도
-    verts, faces, _, _ = measure.marching_cubes(med_img, 200, step_size=5)
-except Exception as e:
-    print(f"첫 번째 marching_cubes 오류: {e}")
-    # 이전 버전 API 시도
-    try:
-        verts, faces, _, _ = measure.marching_cubes_lewiner(volume=med_img, level=200, step_size=5)
-    except Exception as e:
-        print(f"두 번째 marching_cubes 오류: {e}")
-        # 오류 발생 시 기본값 사용
-        verts = np.array([[0, 0, 0], [0, 0, 1], [0, 1, 0], [1, 0, 0]])
-        faces = np.array([[0, 1, 2], [0, 2, 3], [0, 3, 1], [1, 3, 2]])
-x, y, z = verts.T
-i, j, k = faces.T
-
-# 3D 메쉬 초기화
-fig_mesh = go.Figure()
-fig_mesh.add_trace(go.Mesh3d(x=z, y=y, z=x, opacity=0.2, i=k, j=j, k=i))
-
-# 3D 뷰 레이아웃 개선
-fig_mesh.update_layout(
-    scene=dict(
-        xaxis=dict(
-            nticks=10, range=[0, img.shape[2]], 
-            backgroundcolor="rgb(255, 255, 255)",
-            gridcolor="rgb(150, 150, 150)",
-            showbackground=True,
-        ),
-        yaxis=dict(
-            nticks=10, range=[0, img.shape[1]], 
-            backgroundcolor="rgb(255, 255, 255)",
-            gridcolor="rgb(150, 150, 150)",
-            showbackground=True,
+# 3D 메쉬 figure 생성 함수 (스캔별로 미리 계산되어 단순화된 두개골 메쉬 사용)
+def create_mesh_figure(volume):
+    """선택된 볼륨의 두개골 메쉬로 3D 카드 figure를 만듭니다."""
+    verts, faces = load_skull_mesh(volume.name, volume.med_img)
+    x, y, z = np.asarray(verts).T
+    i, j, k = np.asarray(faces).T
+    shape = volume.img.shape
+
+    # 3D 메쉬 초기화
+    fig = go.Figure()
+    # plotly 자체 인코딩은 dtype을 그대로 두므로(u4 면) 두개골 트레이스는 가장 작은 dtype으로 직접 인코딩
+    fig.add_trace(encode_trace(go.Mesh3d(x=z, y=y, z=x, opacity=0.2, i=k, j=j, k=i)))
+    fig.add_trace(go.Mesh3d())  # 병변 메쉬 자리 (lesion_mesh_patch로 교체)
+
+    # 3D 뷰 레이아웃 개선
+    fig.update_layout(
+        scene=dict(
+            xaxis=dict(
+                nticks=10, range=[0, shape[2]], 
+                backgroundcolor="rgb(255, 255, 255)",
+                gridcolor="rgb(150, 150, 150)",
+                showbackground=True,
+            ),
+            yaxis=dict(
+                nticks=10, range=[0, shape[1]], 
+                backgroundcolor="rgb(255, 255, 255)",
+                gridcolor="rgb(150, 150, 150)",
+                showbackground=True,
+            ),
+            zaxis=dict(
+                nticks=10, range=[0, shape[0]], 
+                backgroundcolor="rgb(255, 255, 255)",
+                gridcolor="rgb(150, 150, 150)",
+                showbackground=True,
+            ),
+            aspectratio=dict(x=1, y=1, z=0.8),
+            camera=dict(
+                eye=dict(x=1.5, y=1.5, z=1.5),
+                center=dict(x=0.5, y=0.5, z=0.5),
+                up=dict(x=0, y=0, z=1)
+            ),
         ),
-        zaxis=dict(
-            nticks=10, range=[0, img.shape[0]], 
-            backgroundcolor="rgb(255, 255, 255)",
-            gridcolor="rgb(150, 150, 150)",
-            showbackground=True,
+        margin=dict(l=0, r=0, b=0, t=0),
+        plot_bgcolor="rgb(255, 255, 255)",
+        paper_bgcolor="rgb(255, 255, 255)",
+        autosize=True,
+    )
+    return fig
+
+fig_mesh = create_mesh_figure(default_volume)
+
+# 전체 해상도 병변 메쉬를 계산하기 전까지 마스크를 보관
+pending_meshes = PendingMeshes()
+# 세그멘테이션 결과와 슬라이스별 오버레이 (슬라이더 위치 근처만 인코딩)
+lazy_overlays = LazyOverlays()
+
+def create_lesion_trace(verts, faces):
+    """병변 메쉬 트레이스 (typed array로 인코딩된 dict)"""
+    x, y, z = np.asarray(verts).T
+    i, j, k = np.asarray(faces).T
+    return encode_trace(go.Mesh3d(
+        x=z, y=y, z=x, 
+        color="red", 
+        opacity=0.8, 
+        i=k, j=j, k=i,
+        lighting=dict(
+            ambient=0.3,
+            diffuse=0.8,
+            specular=0.8,
+            roughness=0.5,
+            fresnel=0.2
         ),
-        aspectratio=dict(x=1, y=1, z=0.8),
-        camera=dict(
-            eye=dict(x=1.5, y=1.5, z=1.5),
-            center=dict(x=0.5, y=0.5, z=0.5),
-            up=dict(x=0, y=0, z=1)
+        lightposition=dict(
+            x=100,
+            y=100,
+            z=100
         ),
-    ),
-    margin=dict(l=0, r=0, b=0, t=0),
-    plot_bgcolor="rgb(255, 255, 255)",
-    paper_bgcolor="rgb(255, 255, 255)",
-    autosize=True,
-)
+        showscale=False
+    ))
+
+# 이미지 이름과 윈도우별 슬라이스 피라미드 (슬라이더를 움직이는 동안은 저해상도, 멈추면 전체 해상도)
+slice_pyramids = SlicePyramids(get_volume)
+# 미리 인코딩한 슬라이스 이미지 (슬라이서와 /tiles 엔드포인트가 공유)
+slice_tiles = SliceTiles(slice_pyramids)
+# 타일 응답을 브라우저/프록시가 다시 확인 없이 쓸 수 있는 시간 (초). 이후에는 ETag로 재검증
+TILE_MAX_AGE = int(os.environ.get("TILE_MAX_AGE", 3600))
+
+@server.route("/tiles/<window>/<level>/<int:axis>/<int:index>.<fmt>")
+def serve_slice_tile(window, level, axis, index, fmt):
+    """윈도우를 적용한 슬라이스 이미지 (예: /tiles/brain/full/0/17.png?scan=049.nii)
+
+    level은 full 또는 피라미드 레벨, fmt는 png 또는 webp입니다. scan이 없으면 기본 샘플을 보냅니다.
+    ETag는 스캔 SHA256에서 만들므로 If-None-Match가 맞으면 타일을 읽지 않고 304를 보냅니다.
+    """
+    image_name = flask.request.args.get("scan", DEFAULT_IMAGE_NAME)
+    scans = {image["value"] for image in available_images} | {DEFAULT_IMAGE_NAME}
+    if (image_name not in scans or window not in WINDOW_PRESETS or level not in TILE_LEVELS
+            or axis not in (0, 1, 2) or fmt not in TILE_FORMATS):
+        flask.abort(404)
+    window, level = WINDOW_PRESETS[window], TILE_LEVELS[level]
+
+    etag = tile_etag(image_name, window, level, axis, index, fmt)
+    if etag in flask.request.if_none_match:
+        response = flask.Response(status=304)
+    else:
+        tile = slice_tiles.tile(image_name, window, level, axis, index, fmt)
+        if tile is None:
+            flask.abort(404)
+        response = flask.Response(tile, mimetype=TILE_FORMATS[fmt])
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = TILE_MAX_AGE
+    return response
 
 # 전역 슬라이서 변수 선언
 slicer1 = None
@@ -537,7 +468,7 @@ def create_slicers(app, volume, spacing):
     sagittal_center = volume.shape[1] // 2
     
     # 축방향 슬라이서 생성
-    slicer1 = VolumeSlicer(app, volume, axis=0, spacing=spacing, thumbnail=False)
+    slicer1 = PyramidVolumeSlicer(app, volume, slice_tiles, DEFAULT_IMAGE_NAME, "volume-key", axis=0, spacing=spacing)
     slicer1.graph.figure.update_layout(
         dragmode="drawclosedpath", 
         newshape_line_color="cyan", 
@@ -553,7 +484,7 @@ def create_slicers(app, volume, spacing):
     slicer1.slider.value = axial_center
     
     # 시상면 슬라이서 생성
-    slicer2 = VolumeSlicer(app, volume, axis=1, spacing=spacing, thumbnail=False)
+    slicer2 = PyramidVolumeSlicer(app, volume, slice_tiles, DEFAULT_IMAGE_NAME, "volume-key", axis=1, spacing=spacing)
     slicer2.graph.figure.update_layout(
         dragmode="drawrect", 
         newshape_line_color="cyan", 
@@ -573,18 +504,11 @@ def create_slicers(app, volume, spacing):
 # 초기 슬라이서 생성
 slicer1, slicer2 = create_slicers(app, img, spacing)
 
-def path_to_coords(path):
-    """From SVG path to numpy array of coordinates, each row being a (row, col) point"""
-    indices_str = [
-        el.replace("M", "").replace("Z", "").split(",") for el in path.split("L")
-    ]
-    return np.array(indices_str, dtype=float)
-
-
-def largest_connected_component(mask):
-    labels, _ = ndimage.label(mask)
-    sizes = np.bincount(labels.ravel())[1:]
-    return labels == (np.argmax(sizes) + 1)
+# SVG 경로별 관심 영역 마스크와 관심 영역별 세그멘테이션 세션 (HU 범위만 바뀌면 관심 영역 계산을 재사용)
+roi_masks = RoiMasks()
+segmentation_sessions = SegmentationSessions(roi_masks)
+# true이면 가장 큰 연결 성분 대신 관심 영역 중심에서 flood fill한 성분을 병변으로 사용
+SEEDED_SEGMENTATION = os.environ.get("SEEDED_SEGMENTATION", "False").lower() == "true"
 
 
 t2 = time()
@@ -592,6 +516,9 @@ print("initial calculations", t2 - t1)
 
 # ------------- 앱 레이아웃 정의 ---------------------------------------------------
 
+# 슬라이서 표시 윈도우 프리셋 이름 (windowing.WINDOW_PRESETS의 키)
+WINDOW_PRESET_LABELS = {"brain": "뇌", "subdural": "경막하", "bone": "뼈"}
+
 # 이미지 선택 드롭다운 - 카드 대신 단순 드롭다운으로 변경
 image_selection = html.Div([
     html.H6("뇌 CT 이미지 선택", className="mt-2 mb-2", style={"font-weight": "500", "font-size": "1.1rem"}),
@@ -602,6 +529,26 @@ image_selection = html.Div([
         placeholder="분석할 이미지를 선택하세요",
         className="mb-4"
     ),
+    # 슬라이서 표시 윈도우 (level/width)
+    html.H6("표시 윈도우", className="mb-2", style={"font-weight": "500", "font-size": "1.1rem"}),
+    dbc.RadioItems(
+        id="window-preset",
+        options=[
+            {"label": f"{WINDOW_PRESET_LABELS[name]} ({level}/{width})", "value": name}
+            for name, (level, width) in WINDOW_PRESETS.items()
+        ],
+        value="brain",
+        inline=True,
+        className="mb-3"
+    ),
+    # 판독의 정답 마스크 윤곽 표시 (축방향 뷰)
+    dbc.Checklist(
+        id="ground-truth-toggle",
+        options=[{"label": "정답 병변 윤곽 표시", "value": "show"}],
+        value=[],
+        switch=True,
+        className="mb-3"
+    ),
     # 환자 정보 카드 추가
     dbc.Card([
         dbc.CardHeader([
@@ -1047,8 +994,10 @@ app.layout = html.Div(
         ),
         
         # 저장소 및 모달
+        dcc.Store(id="volume-key", data=None),  # 세션이 보고 있는 이미지 이름
         dcc.Store(id="annotations", data={}),
-        dcc.Store(id="occlusion-surface", data={}),
+        dcc.Store(id="lesion-mesh-key", data=None),  # 전체 해상도 메쉬를 만들 마스크의 키
+        dcc.Store(id="overlay-key", data=None),  # 서버에 보관한 세그멘테이션 결과(오버레이)의 키
         dcc.Store(id="slice-state", data={"axial": axial_center, "sagittal": sagittal_center}),
         dcc.Store(id="chat-history", data=[]),
         dcc.Store(id="analysis-context", data={}),
@@ -1097,19 +1046,19 @@ def toggle_roi_warning(annotations):
 @app.callback(
     [Output(slicer1.slider.id, "max"),
      Output(slicer2.slider.id, "max"),
-     Output("patient-info", "children")],
+     Output("patient-info", "children"),
+     Output("volume-key", "data")],
     [Input("image-dropdown", "value")],
     prevent_initial_call=False  # 초기 로딩을 위해 False로 설정
 )
 def update_image_basic_info(selected_image):
     # 초기 로딩 시 기본 이미지 사용
     if selected_image is None:
-        selected_image = available_images[0]['value'] if available_images else "기본 뇌 CT 샘플 이미지 (NII)"
+        selected_image = available_images[0]['value'] if available_images else DEFAULT_IMAGE_NAME
     
-    # 이미지 로드
-    global img, spacing, med_img
-    img, spacing = load_image(selected_image)
-    med_img = filters.median(img, footprint=np.ones((1, 3, 3), dtype=bool))
+    # 이미지 로드 (저장소에 있으면 재사용)
+    volume = get_volume(selected_image)
+    img, spacing = volume.img, volume.spacing
     
     print("\n" + "=" * 60)
     print(f"🔄 이미지 변경: {selected_image}")
@@ -1118,18 +1067,9 @@ def update_image_basic_info(selected_image):
     print(f"📐 새 이미지 스페이싱: {spacing}")
     print(f"🏥 HU 값 범위: {img.min():.1f} ~ {img.max():.1f}")
     print(f"📊 평균 HU 값: {img.mean():.1f}")
-    
-    # 슬라이서 설정 업데이트
-    if slicer1 and slicer2:
-        print(f"🔄 슬라이서 업데이트 중...")
-        slicer1.volume = img
-        slicer1.spacing = spacing
-        slicer1._volume = img  # 내부 volume 참조도 업데이트
-        slicer2.volume = img
-        slicer2.spacing = spacing
-        slicer2._volume = img  # 내부 volume 참조도 업데이트
-        
-        print(f"✅ 슬라이서 업데이트 완료")
+    if volume.lesion_mask is not None and volume.lesion_mask.bbox is not None:
+        z0, z1, r0, r1, c0, c1 = volume.lesion_mask.bbox
+        print(f"🩸 정답 병변 범위: 슬라이스 {z0}~{z1 - 1}, 행 {r0}~{r1 - 1}, 열 {c0}~{c1 - 1}")
     
     print(f"📍 Axial 중앙: {img.shape[0] // 2}, Sagittal 중앙: {img.shape[1] // 2}")
     
@@ -1270,7 +1210,37 @@ def update_image_basic_info(selected_image):
         ], className="mb-0") if detailed_cards or patient_data['patient_num'] != '샘플' else None
     ])
     
-    return img.shape[0]-1, img.shape[1]-1, patient_info
+    return img.shape[0]-1, img.shape[1]-1, patient_info, selected_image
+
+# 윈도우 프리셋 콜백 - 슬라이서 clim을 바꾸면 슬라이서가 그 윈도우의 미리 인코딩된 슬라이스를 보냄
+# (볼륨은 다시 읽지 않고, 윈도우를 적용한 볼륨은 (스캔, 프리셋)별로 캐시됨)
+@app.callback(
+    [Output(slicer1.clim.id, "data"),
+     Output(slicer2.clim.id, "data")],
+    [Input("window-preset", "value")],
+    prevent_initial_call=True
+)
+def update_window_preset(preset):
+    clim = list(window_bounds(*WINDOW_PRESETS.get(preset, BRAIN_WINDOW)))
+    print(f"🪟 표시 윈도우 변경: {preset} ({clim[0]:g} ~ {clim[1]:g} HU)")
+    return clim, clim
+
+# 정답 마스크 콜백 - 축방향 뷰의 현재 슬라이스에 판독의 병변 윤곽선을 그림
+# (비트 압축 마스크에서 그 슬라이스만 풀고, 병변이 없는 슬라이스는 풀지 않음)
+@app.callback(
+    Output(slicer1.extra_traces.id, "data"),
+    [Input(slicer1.slider.id, "value"),
+     Input("ground-truth-toggle", "value"),
+     Input("volume-key", "data")]
+)
+def update_ground_truth_contour(axial_idx, show, volume_key):
+    if not show or axial_idx is None:
+        return []
+    volume = get_volume(volume_key)
+    lesion_mask = volume.lesion_mask
+    if lesion_mask is None or not 0 <= axial_idx < lesion_mask.shape[0] or not lesion_mask.nonempty[axial_idx]:
+        return []
+    return contour_traces(lesion_mask.slice(axial_idx), volume.spacing[1:])
 
 # 이미지 선택 콜백 - 그래프와 슬라이더 업데이트 + shapes 초기화
 @app.callback(
@@ -1289,6 +1259,7 @@ def update_image_graphs_and_clear_shapes(selected_image, fig1, fig2):
     
     # 환자 정보 가져오기
     patient_data = get_patient_info(selected_image)
+    img = get_volume(selected_image).img
     
     # 이미지의 중앙 슬라이스 계산
     axial_center = img.shape[0] // 2
@@ -1336,34 +1307,43 @@ def update_image_graphs_and_clear_shapes(selected_image, fig1, fig2):
     
     return new_fig1, new_fig2, axial_center, sagittal_center
 
-# 클라이언트 사이드 콜백 제거하고 서버 측 콜백으로 대체
+def lesion_mesh_patch(trace):
+    """3D 뷰 figure 전체를 주고받지 않고 병변 트레이스(data[1])만 바꾸는 Patch"""
+    fig = dash.Patch()
+    fig["data"][1] = trace
+    return fig
+
+# 미리보기 다음에 전체 해상도 병변 메쉬로 교체
 @app.callback(
-    Output("graph-helper", "figure"),
-    [Input("occlusion-surface", "data")],
-    [State("graph-helper", "figure")]
+    Output("graph-helper", "figure", allow_duplicate=True),
+    [Input("lesion-mesh-key", "data")],
+    prevent_initial_call=True
 )
-def update_3d_mesh(surf, current_figure):
-    """3D 메쉬 업데이트를 위한 간단한 서버 측 콜백"""
-    # surf가 None이면 현재 figure 유지
-    if surf is None:
-        return current_figure
-    
-    # 현재 figure에 surf 추가
-    fig = current_figure.copy() if current_figure else fig_mesh
-    
-    # 기존 데이터가 있는 경우
-    if 'data' in fig and len(fig['data']) > 0:
-        # 기존 데이터가 두 개 이상이면 두 번째 데이터 교체
-        if len(fig['data']) > 1:
-            fig['data'][1] = surf
-        else:
-            # 데이터가 하나만 있는 경우 두 번째로 추가
-            fig['data'].append(surf)
-    else:
-        # 데이터가 없는 경우 초기화
-        fig['data'] = [surf]
-    
-    return fig
+def update_full_resolution_mesh(mesh_key):
+    pending = pending_meshes.pop(mesh_key) if mesh_key else None
+    if pending is None:
+        # 다른 워커에서 만든 요청이거나 이미 처리됨: 미리보기 유지
+        return dash.no_update
+    t_start = time()
+    try:
+        mask, offset = pending
+        verts, faces = lesion_mesh(mask, offset=offset)
+    except Exception as e:
+        print(f"전체 해상도 marching_cubes 오류: {e}")
+        return dash.no_update
+    print("full resolution marching cubes", time() - t_start)
+    return lesion_mesh_patch(create_lesion_trace(verts, faces))
+
+# 이미지 변경 시 선택된 환자의 두개골 메쉬로 3D 뷰 교체
+@app.callback(
+    Output("graph-helper", "figure", allow_duplicate=True),
+    [Input("image-dropdown", "value")],
+    prevent_initial_call='initial_duplicate'
+)
+def update_skull_mesh_on_image_change(selected_image):
+    if selected_image is None:
+        return dash.no_update
+    return create_mesh_figure(get_volume(selected_image))
 
 @app.callback(
     Output("annotations", "data"),
@@ -1460,64 +1440,33 @@ def initialize_sliders(_):
 @app.callback(
     [Output("graph-histogram", "figure"), Output("roi-warning", "is_open")],
     [Input("annotations", "data")],
+    [State("volume-key", "data")],
 )
-def update_histo(annotations):
+def update_histo(annotations, volume_key):
     if (
         annotations is None
         or annotations.get("x") is None
         or annotations.get("z") is None
     ):
         return dash.no_update, dash.no_update
-    # Horizontal mask for the xy plane (z-axis)
-    path = path_to_coords(annotations["z"]["path"])
-    
-    # 좌표를 이미지 경계 내로 제한하는 함수
-    def clip_to_image_bounds(coords, shape):
-        return np.clip(coords, 0, shape - 1)
-    
-    # 좌표 계산 및 경계 확인
-    r_coords = path[:, 1] / spacing[1]
-    c_coords = path[:, 0] / spacing[2]
-    
-    # 이미지 크기 가져오기
-    height, width = img.shape[1], img.shape[2]
-    
-    # 폴리곤 좌표 생성 전에 경계 내에 있는지 확인
-    if np.any(r_coords < 0) or np.any(r_coords >= height) or np.any(c_coords < 0) or np.any(c_coords >= width):
-        print(f"경고: 일부 좌표가 이미지 경계를 벗어났습니다. 경계 내로 제한합니다.")
-        r_coords = np.clip(r_coords, 0, height - 1)
-        c_coords = np.clip(c_coords, 0, width - 1)
-    
-    # 폴리곤 좌표 생성
+    volume = get_volume(volume_key)
+    img, med_img, spacing = volume.img, volume.med_img, volume.spacing
+    # Horizontal mask for the xy plane (z-axis): 세그멘테이션 콜백과 같은 캐시를 사용
     try:
-        rr, cc = draw.polygon(r_coords, c_coords)
-        
-        # 생성된 좌표가 경계 내에 있는지 다시 확인
-        valid_indices = (rr < height) & (cc < width)
-        if not np.all(valid_indices):
-            print(f"경고: 생성된 폴리곤 좌표 중 {np.sum(~valid_indices)}개가 경계를 벗어났습니다.")
-            rr = rr[valid_indices]
-            cc = cc[valid_indices]
-            
-        if len(rr) == 0 or len(cc) == 0:
-            print("오류: 유효한 폴리곤 좌표가 없습니다.")
-            return dash.no_update, dash.no_update
-                
-        mask = np.zeros(img.shape[1:], dtype=bool)
-        mask[rr, cc] = 1
-        mask = ndimage.binary_fill_holes(mask)
-        
+        mask = roi_masks.get(annotations["z"]["path"], spacing, img.shape[1:])
     except Exception as e:
         print(f"폴리곤 생성 오류: {e}")
         return dash.no_update, dash.no_update
+    if mask is None:
+        return dash.no_update, dash.no_update
     
     # top and bottom, the top is a lower number than the bottom because y values
     # increase moving down the figure
     top, bottom = sorted([int(annotations["x"][c] / spacing[0]) for c in ["y0", "y1"]])
-    intensities = med_img[top:bottom, mask].ravel()
-    if len(intensities) == 0:
+    # 스캔별 히스토그램 인덱스로 완전히 덮인 타일은 한 번에 더하고 경계만 직접 계산
+    hi = roi_histogram(med_img, mask, top, bottom, volume.roi_histograms)
+    if hi is None:
         return dash.no_update, dash.no_update
-    hi = exposure.histogram(intensities)
     fig = px.bar(
         x=hi[1],
         y=hi[0],
@@ -1569,16 +1518,23 @@ app.clientside_callback(
 )
 
 @app.callback(
-    [Output("occlusion-surface", "data"),
+    # 미리보기 병변 메쉬는 저장소를 거치지 않고 3D 뷰에 바로 패치
+    [Output("graph-helper", "figure", allow_duplicate=True),
         Output(slicer1.overlay_data.id, "data"),
         Output(slicer2.overlay_data.id, "data"),
         Output("analysis-results", "children"),
         Output("infection-stats", "children"),
+        Output("lesion-mesh-key", "data"),
+        Output("overlay-key", "data"),
     ],
     [Input("graph-histogram", "selectedData"), Input("annotations", "data")],
+    [State("volume-key", "data"), State(slicer1.slider.id, "value"), State(slicer2.slider.id, "value")],
+    prevent_initial_call="initial_duplicate",
 )
-def update_segmentation_slices(selected, annotations):
+def update_segmentation_slices(selected, annotations, volume_key, axial_idx, sagittal_idx):
     ctx = dash.callback_context
+    volume = get_volume(volume_key)
+    img, med_img, spacing = volume.img, volume.med_img, volume.spacing
     # When shape annotations are changed, reset segmentation visualization
     if (
         ctx.triggered[0]["prop_id"] == "annotations.data"
@@ -1586,131 +1542,48 @@ def update_segmentation_slices(selected, annotations):
         or annotations.get("x") is None
         or annotations.get("z") is None
     ):
-        # 이미지 크기에 맞는 빈 마스크 생성
-        mask = np.zeros_like(med_img, dtype=bool)
-        try:
-            overlay1 = safe_create_overlay(slicer1, mask)
-            overlay2 = safe_create_overlay(slicer2, mask)
-        except Exception as e:
-            print(f"안전한 오버레이 생성 실패: {e}")
-            overlay1 = None
-            overlay2 = None
-        return go.Mesh3d(), overlay1, overlay2, "관심 영역을 선택하고 히스토그램에서 범위를 지정하세요.", "통계 정보가 여기에 표시됩니다."
+        # 마스크 배열 없이 모든 슬라이스를 빈 오버레이로
+        overlay1 = empty_overlay_data(img.shape, slicer1.axis)
+        overlay2 = empty_overlay_data(img.shape, slicer2.axis)
+        return lesion_mesh_patch(go.Mesh3d()), overlay1, overlay2, "관심 영역을 선택하고 히스토그램에서 범위를 지정하세요.", "통계 정보가 여기에 표시됩니다.", None, None
     elif selected is not None and "range" in selected:
         if len(selected["points"]) == 0:
-            return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+            return (dash.no_update,) * 7
         v_min, v_max = selected["range"]["x"]
         t_start = time()
-        # Horizontal mask
-        path = path_to_coords(annotations["z"]["path"])
-        
-        # 좌표 계산 및 경계 확인
-        r_coords = path[:, 1] / spacing[1]
-        c_coords = path[:, 0] / spacing[2]
-        
-        # 이미지 크기 가져오기
-        height, width = img.shape[1], img.shape[2]
-        
-        # 폴리곤 좌표 생성 전에 경계 내에 있는지 확인
-        if np.any(r_coords < 0) or np.any(r_coords >= height) or np.any(c_coords < 0) or np.any(c_coords >= width):
-            print(f"경고: 일부 좌표가 이미지 경계를 벗어났습니다. 경계 내로 제한합니다.")
-            r_coords = np.clip(r_coords, 0, height - 1)
-            c_coords = np.clip(c_coords, 0, width - 1)
-        
-        # 폴리곤 좌표 생성
+        # 관심 영역(폴리곤 × 슬라이스 범위)이 그대로면 세션을 재사용하고 임계값만 다시 적용
         try:
-            rr, cc = draw.polygon(r_coords, c_coords)
-            
-            # 생성된 좌표가 경계 내에 있는지 다시 확인
-            valid_indices = (rr < height) & (cc < width)
-            if not np.all(valid_indices):
-                print(f"경고: 생성된 폴리곤 좌표 중 {np.sum(~valid_indices)}개가 경계를 벗어났습니다.")
-                rr = rr[valid_indices]
-                cc = cc[valid_indices]
-                
-            if len(rr) == 0 or len(cc) == 0:
-                print("오류: 유효한 폴리곤 좌표가 없습니다.")
-                return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
-                
-            mask = np.zeros(img.shape[1:], dtype=bool)
-            mask[rr, cc] = 1
-            mask = ndimage.binary_fill_holes(mask)
-            
+            session = segmentation_sessions.get(volume, annotations)
         except Exception as e:
             print(f"폴리곤 생성 오류: {e}")
-            return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
-            
-        # top and bottom, the top is a lower number than the bottom because y values
-        # increase moving down the figure
-        top, bottom = sorted(
-            [int(annotations["x"][c] / spacing[0]) for c in ["y0", "y1"]]
-        )
-        
-        # 이미지 높이 범위 확인 및 조정
-        depth = img.shape[0]
-        if top < 0 or bottom >= depth:
-            print(f"경고: 높이 범위({top}, {bottom})가 이미지 높이({depth})를 벗어났습니다. 범위를 조정합니다.")
-            top = max(0, min(top, depth-1))
-            bottom = max(0, min(bottom, depth-1))
-            if top >= bottom:
-                bottom = min(top + 1, depth-1)
-                
-        # 마스크 생성
-        img_mask = np.logical_and(med_img > v_min, med_img <= v_max)
-        img_mask[:top] = False
-        img_mask[bottom:] = False
-        img_mask[top:bottom, np.logical_not(mask)] = False
-        img_mask = largest_connected_component(img_mask)
+            return (dash.no_update,) * 7
+        if session is None:
+            return (dash.no_update,) * 7
+        top, bottom = session.top, session.bottom
+        img_mask = session.segment(v_min, v_max, seeded=SEEDED_SEGMENTATION)
         t_end = time()
         print("build the mask", t_end - t_start)
         
         t_start = time()
-        # Update 3d viz
+        # Update 3d viz: 미리보기(큰 step_size + 삼각형 예산)를 먼저 보내고 전체 해상도는 후속 콜백에서
+        # 평활화와 메쉬, 오버레이 모두 잘라낸 영역에서 계산
+        # 결과 마스크는 서버에 두고 오버레이는 현재 슬라이스 근처만 만든 뒤 슬라이더를 따라 채움
+        overlay_key = lazy_overlays.put(img_mask, session.offset)
+        smoothed_mask = filters.median(img_mask, footprint=LESION_SMOOTH_FOOTPRINT)
         try:
-            # 최신 버전 API 시도
-            verts, faces, _, _ = measure.marching_cubes(
-                filters.median(img_mask, footprint=np.ones((1, 7, 7))), 0.5, step_size=3
-            )
+            verts, faces = lesion_preview_mesh(smoothed_mask, offset=session.offset)
         except Exception as e:
-            print(f"첫 번째 marching_cubes 오류: {e}")
-            try:
-                # 이전 버전 API 시도
-                verts, faces, _, _ = measure.marching_cubes_lewiner(
-                    volume=filters.median(img_mask, footprint=np.ones((1, 7, 7))), level=0.5, step_size=3
-                )
-            except Exception as e:
-                print(f"두 번째 marching_cubes 오류: {e}")
-                # 오류 발생 시 빈 메쉬 반환
-                return go.Mesh3d(), safe_create_overlay(slicer1, img_mask), safe_create_overlay(slicer2, img_mask), "오류가 발생했습니다.", "통계를 계산할 수 없습니다."
+            print(f"marching_cubes 오류: {e}")
+            # 오류 발생 시 빈 메쉬 반환
+            return lesion_mesh_patch(go.Mesh3d()), safe_create_overlay(img.shape, slicer1.axis, overlay_key, axial_idx), safe_create_overlay(img.shape, slicer2.axis, overlay_key, sagittal_idx), "오류가 발생했습니다.", "통계를 계산할 수 없습니다.", None, overlay_key
         t_end = time()
-        print("marching cubes", t_end - t_start)
-        x, y, z = verts.T
-        i, j, k = faces.T
-        
-        # 단순화된 3D 메쉬 생성 - 단일 Mesh3d 트레이스만 반환
-        trace = go.Mesh3d(
-            x=z, y=y, z=x, 
-            color="red", 
-            opacity=0.8, 
-            i=k, j=j, k=i,
-            lighting=dict(
-                ambient=0.3,
-                diffuse=0.8,
-                specular=0.8,
-                roughness=0.5,
-                fresnel=0.2
-            ),
-            lightposition=dict(
-                x=100,
-                y=100,
-                z=100
-            ),
-            showscale=False
-        )
+        print("marching cubes (preview)", t_end - t_start)
+        mesh_patch = lesion_mesh_patch(create_lesion_trace(verts, faces))
+        mesh_key = pending_meshes.put(smoothed_mask, session.offset)
         
         try:
-            overlay1 = safe_create_overlay(slicer1, img_mask)
-            overlay2 = safe_create_overlay(slicer2, img_mask)
+            overlay1 = safe_create_overlay(img.shape, slicer1.axis, overlay_key, axial_idx)
+            overlay2 = safe_create_overlay(img.shape, slicer2.axis, overlay_key, sagittal_idx)
         except Exception as e:
             print(f"안전한 오버레이 생성 실패: {e}")
             overlay1 = None
@@ -1737,24 +1610,12 @@ def update_segmentation_slices(selected, annotations):
             ai_diagnosis = "추가 검사 필요"
             ai_color = "green"
         
-        # 현재 선택된 이미지의 환자 정보 가져오기 (교육용 비교)
-        current_image = None
-        for img_option in available_images:
-            if 'value' in img_option:
-                # 현재 분석 중인 이미지 찾기 (전역 변수 사용)
-                try:
-                    # 현재 로드된 환자 정보와 비교
-                    patient_data = get_patient_info(img_option['value'])
-                    if patient_data['total_slices'] > 0:  # 실제 환자 데이터가 있는 경우
-                        current_image = img_option['value']
-                        break
-                except:
-                    continue
+        # 세션이 보고 있는 이미지의 환자 정보 가져오기 (교육용 비교)
+        patient_data = get_patient_info(volume.name)
         
         # 교육용 비교 정보
         education_content = []
-        if current_image:
-            patient_data = get_patient_info(current_image)
+        if patient_data['total_slices'] > 0:  # 실제 환자 데이터가 있는 경우
             actual_diagnosis = ', '.join(patient_data['hemorrhage_types']) if patient_data['hemorrhage_types'] else '정상'
             
             education_content.extend([
@@ -1815,45 +1676,53 @@ def update_segmentation_slices(selected, annotations):
             ], className="text-muted", style={"fontSize": "0.8rem"})
         ])
         
-        return trace, overlay1, overlay2, results, stats
+        return mesh_patch, overlay1, overlay2, results, stats, mesh_key, overlay_key
     else:
-        return (dash.no_update,) * 5
+        return (dash.no_update,) * 7
+
+# 슬라이더를 움직이면 새 위치 근처의 오버레이 슬라이스만 패치 (크기는 세션이 보고 있는 볼륨 기준)
+def patch_overlay_window(axis, overlay_key, volume_key, slice_idx):
+    if not overlay_key:
+        return dash.no_update
+    try:
+        uris = lazy_overlays.window(overlay_key, get_volume(volume_key).img.shape, axis, slice_idx)
+    except Exception as e:
+        print(f"오버레이 생성 오류 ({axis}축): {e}")
+        return dash.no_update
+    if not uris:
+        return dash.no_update
+    patch = dash.Patch()
+    for index, uri in uris.items():
+        patch[index] = uri
+    return patch
+
+@app.callback(
+    Output(slicer1.overlay_data.id, "data", allow_duplicate=True),
+    [Input(slicer1.slider.id, "value")],
+    [State("overlay-key", "data"), State("volume-key", "data")],
+    prevent_initial_call=True
+)
+def update_axial_overlay(slice_idx, overlay_key, volume_key):
+    return patch_overlay_window(slicer1.axis, overlay_key, volume_key, slice_idx)
+
+@app.callback(
+    Output(slicer2.overlay_data.id, "data", allow_duplicate=True),
+    [Input(slicer2.slider.id, "value")],
+    [State("overlay-key", "data"), State("volume-key", "data")],
+    prevent_initial_call=True
+)
+def update_sagittal_overlay(slice_idx, overlay_key, volume_key):
+    return patch_overlay_window(slicer2.axis, overlay_key, volume_key, slice_idx)
 
 # 안전한 오버레이 생성 함수
-def safe_create_overlay(slicer, mask):
-    """크기 불일치를 처리하는 안전한 오버레이 생성 함수"""
+def safe_create_overlay(shape, axis, overlay_key, slice_idx):
+    """shape 볼륨의 현재 슬라이스 근처만 채운 오버레이를 만들고, 실패하면 빈 오버레이를 반환합니다."""
     try:
-        # 현재 슬라이서의 볼륨 크기 확인
-        slicer_volume_shape = slicer._volume.shape
-        
-        # 마스크 크기가 다르면 조정
-        if mask.shape != slicer_volume_shape:
-            print(f"경고: 마스크 크기 {mask.shape}가 슬라이서 볼륨 크기 {slicer_volume_shape}와 다릅니다.")
-            
-            # 현재 이미지 크기에 맞는 새 마스크 생성
-            adjusted_mask = np.zeros(slicer_volume_shape, dtype=bool)
-            
-            # 공통 크기 계산 (작은 쪽에 맞춤)
-            min_z = min(mask.shape[0], slicer_volume_shape[0])
-            min_y = min(mask.shape[1], slicer_volume_shape[1])
-            min_x = min(mask.shape[2], slicer_volume_shape[2])
-            
-            # 유효한 영역만 복사
-            adjusted_mask[:min_z, :min_y, :min_x] = mask[:min_z, :min_y, :min_x]
-            mask = adjusted_mask
-            print(f"마스크 크기를 {adjusted_mask.shape}로 조정했습니다.")
-        
-        return slicer.create_overlay_data(mask)
-        
+        return lazy_overlays.overlay_data(overlay_key, shape, axis, slice_idx)
     except Exception as e:
-        print(f"오버레이 생성 오류 ({slicer._axis}축): {e}")
-        # 빈 마스크로 재시도
-        try:
-            empty_mask = np.zeros(slicer._volume.shape, dtype=bool)
-            return slicer.create_overlay_data(empty_mask)
-        except:
-            print(f"빈 마스크 오버레이 생성도 실패했습니다.")
-            return None
+        print(f"오버레이 생성 오류 ({axis}축): {e}")
+        # 빈 오버레이로 대체
+        return empty_overlay_data(shape, axis)
 
 # 이미지 변경 시 어노테이션 초기화
 @app.callback(
@@ -0,0 +1,154 @@
+"""처리 경로별 성능 비교 스크립트
+
+사용법: python benchmark.py {smoothing|transport|components} [049.nii ...]
+인자가 없으면 dash-brain-ct-data/ct_scans 의 스캔을 사용하고, 스캔이 없으면
+512x512x30 크기의 합성 볼륨으로 측정합니다.
+"""
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+from skimage import filters
+
+from volume_cache import DATASET_DIR, image_path, read_nifti
+
+
+def _timeit(fn, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t = perf_counter()
+        result = fn()
+        best = min(best, perf_counter() - t)
+    return best, result
+
+
+def iter_volumes(names):
+    """(이름, int16 HU 볼륨) 쌍을 순서대로 반환합니다."""
+    if not names:
+        ct_scans_dir = os.path.join(DATASET_DIR, "ct_scans")
+        if os.path.isdir(ct_scans_dir):
+            names = sorted(f for f in os.listdir(ct_scans_dir) if f.lower().endswith((".nii", ".nii.gz")))
+    if not names:
+        rng = np.random.default_rng(0)
+        yield "합성 512x512x30", rng.integers(-1024, 2000, (30, 512, 512)).astype(np.int16)
+        return
+    for name in names:
+        img, _ = read_nifti(image_path(name))
+        yield name, img
+
+
+def bench_smoothing(names):
+    from smoothing import MEDIAN_FOOTPRINT, median_smooth
+
+    print(f"{'스캔':<16}{'크기':<18}{'float64 (s)':>12}{'int16 엔진 (s)':>16}{'속도 향상':>10}  일치")
+    for name, img in iter_volumes(names):
+        t_ref, ref = _timeit(lambda: filters.median(img.astype(np.float64), footprint=MEDIAN_FOOTPRINT), repeat=1)
+        t_new, out = _timeit(lambda: median_smooth(img))
+        same = np.array_equal(out.astype(np.float64), ref)
+        print(f"{name:<16}{str(img.shape):<18}{t_ref:>12.3f}{t_new:>16.3f}{t_ref / t_new:>9.1f}x  {same}")
+
+
+def _as_lists(value):
+    """typed array 도입 전처럼 배열을 JSON 숫자 목록으로 바꿉니다."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, dict):
+        return {k: _as_lists(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_as_lists(v) for v in value]
+    return value
+
+
+def bench_transport(names):
+    import plotly.graph_objects as go
+    from dash._utils import to_json
+    from skimage import exposure
+
+    from figure_codec import encode_trace
+    from meshes import compute_skull_mesh, decimate_mesh, lesion_mesh
+    from smoothing import median_smooth
+
+    # JSON: 숫자 목록 (plotly 5 이하), plotly: plotly 6+ 자체 bdata 인코딩 (dtype 그대로), typed: figure_codec
+    print(f"{'스캔':<16}{'figure':<12}{'JSON (KB)':>11}{'(ms)':>8}{'plotly (KB)':>13}{'(ms)':>8}"
+          f"{'typed (KB)':>12}{'(ms)':>8}{'plotly 대비':>11}")
+    for name, img in iter_volumes(names):
+        med_img = median_smooth(img)
+        verts, faces = decimate_mesh(*compute_skull_mesh(med_img))
+        x, y, z = np.asarray(verts).T
+        i, j, k = np.asarray(faces).T
+        lesion_verts, lesion_faces = lesion_mesh(((med_img > 40) & (med_img < 80)).astype(np.float32))
+        lx, ly, lz = lesion_verts.T
+        li, lj, lk = lesion_faces.T
+        hi = exposure.histogram(med_img.astype(np.float32))
+        traces = {
+            "skull mesh": go.Mesh3d(x=z, y=y, z=x, i=k, j=j, k=i, opacity=0.2),
+            "lesion mesh": go.Mesh3d(x=lz, y=ly, z=lx, i=lk, j=lj, k=li, color="red"),
+            "histogram": go.Bar(x=hi[1], y=hi[0]),
+        }
+        for label, trace in traces.items():
+            t_json, body_json = _timeit(lambda: to_json(_as_lists(trace.to_plotly_json())))
+            t_plotly, body_plotly = _timeit(lambda: to_json(go.Figure(trace).to_dict()["data"][0]))
+            t_typed, body_typed = _timeit(lambda: to_json(encode_trace(trace)))
+            print(f"{name:<16}{label:<12}{len(body_json) / 1024:>11.1f}{t_json * 1000:>8.1f}"
+                  f"{len(body_plotly) / 1024:>13.1f}{t_plotly * 1000:>8.1f}"
+                  f"{len(body_typed) / 1024:>12.1f}{t_typed * 1000:>8.1f}{len(body_plotly) / len(body_typed):>10.1f}x")
+
+
+def bench_components(names):
+    from scipy import ndimage
+
+    from segmentation import SegmentationSession, label_components, largest_connected_component, nearest_voxel
+    from smoothing import median_smooth
+    from volume_store import Volume
+
+    print(f"{'스캔':<16}{'HU 범위':<12}{'전체 (ms)':>10}{'라벨 MB':>9}{'잘라냄 (ms)':>12}{'라벨 MB':>9}"
+          f"{'seed (ms)':>11}  일치")
+    for name, img in iter_volumes(names):
+        med_img = median_smooth(img)
+        depth, height, width = med_img.shape
+        # 관심 영역: 가운데 1/2 × 1/2 사각형, 가운데 절반 슬라이스
+        roi_mask = np.zeros((height, width), dtype=bool)
+        roi_mask[height // 4:3 * height // 4, width // 4:3 * width // 4] = True
+        top, bottom = depth // 4, max(depth // 4 + 1, 3 * depth // 4)
+        session = SegmentationSession(Volume(name, img, med_img, (1.0, 1.0, 1.0)), roi_mask, top, bottom)
+
+        for v_min, v_max in [(40, 90), (-100, 100)]:
+            def full():
+                mask = np.logical_and(med_img > v_min, med_img <= v_max)
+                mask[:top] = False
+                mask[bottom:] = False
+                mask[top:bottom, ~roi_mask] = False
+                labels, _ = ndimage.label(mask)
+                sizes = np.bincount(labels.ravel())[1:]
+                return labels == (np.argmax(sizes) + 1), labels.nbytes
+
+            crop_mask = session.threshold(v_min, v_max)
+            if not crop_mask.any():
+                continue
+            t_full, (ref, full_bytes) = _timeit(full)
+            t_crop, out = _timeit(lambda: largest_connected_component(session.threshold(v_min, v_max)))
+            crop_bytes = label_components(crop_mask)[0].nbytes
+            def seeded():
+                mask = session.threshold(v_min, v_max)
+                return largest_connected_component(mask, nearest_voxel(mask, session.center, session.spacing))
+
+            t_seed, _ = _timeit(seeded)
+            same = np.array_equal(session.full_mask(out), ref)
+            print(f"{name:<16}{f'{v_min}~{v_max}':<12}{t_full * 1000:>10.1f}{full_bytes / 2**20:>9.2f}"
+                  f"{t_crop * 1000:>12.1f}{crop_bytes / 2**20:>9.2f}{t_seed * 1000:>11.1f}  {same}")
+
+
+BENCHMARKS = {
+    "smoothing": bench_smoothing,
+    "transport": bench_transport,
+    "components": bench_components,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"사용법: python benchmark.py {{{'|'.join(BENCHMARKS)}}} [스캔 이름 ...]")
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](sys.argv[2:])
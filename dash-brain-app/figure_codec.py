@@ -0,0 +1,65 @@
+"""단독 트레이스용 typed array 인코딩
+
+plotly 6부터 go.Figure는 numpy 배열을 typed array(bdata)로 직렬화하지만 dtype은 그대로 둡니다 (u4 면 등).
+dcc.Store나 dash.Patch로 보내는 단독 트레이스(go.Mesh3d 등)는 여전히 JSON 숫자 목록으로
+직렬화되므로 여기서 값을 잃지 않는 가장 작은 dtype의 typed array로 바꿉니다.
+figure에 add_trace로 넣은 인코딩 결과는 plotly가 그대로 보냅니다 (두개골 메쉬).
+"""
+import base64
+
+import numpy as np
+
+# plotly.js가 읽을 수 있는 typed array dtype (64비트 정수는 지원하지 않음)
+_INT_DTYPES = [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32]
+
+
+def _compact_dtype(arr):
+    """값을 잃지 않는 가장 작은 plotly.js typed array dtype"""
+    if arr.dtype.kind == "b":
+        return np.dtype(np.uint8)
+    if arr.dtype.kind in "iu":
+        lo, hi = (int(arr.min()), int(arr.max())) if arr.size else (0, 0)
+        for dtype in _INT_DTYPES:
+            info = np.iinfo(dtype)
+            if info.min <= lo and hi <= info.max:
+                return np.dtype(dtype)
+        return np.dtype(np.float64)
+    if arr.dtype == np.float64:
+        # float32로 표현해도 값이 같을 때만 줄임 (HU, 양자화된 정점 좌표 등)
+        as_f4 = arr.astype(np.float32)
+        if np.array_equal(as_f4, arr, equal_nan=True):
+            return np.dtype(np.float32)
+        return arr.dtype
+    return np.dtype(np.float32)
+
+
+def encode_array(arr):
+    """numpy 배열을 plotly.js typed array 표현 {'dtype', 'bdata'[, 'shape']}으로 변환합니다."""
+    arr = np.asarray(arr)
+    dtype = _compact_dtype(arr)
+    data = np.ascontiguousarray(arr, dtype=dtype.newbyteorder("<"))
+    encoded = {
+        "dtype": dtype.str.lstrip("<|="),
+        "bdata": base64.b64encode(data.tobytes()).decode("ascii"),
+    }
+    if data.ndim > 1:
+        encoded["shape"] = ", ".join(str(n) for n in data.shape)
+    return encoded
+
+
+def _encode_value(value):
+    if isinstance(value, np.ndarray) and value.dtype.kind in "biuf" and value.size > 0:
+        return encode_array(value)
+    if isinstance(value, dict):
+        return {k: _encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(v) for v in value]
+    return value
+
+
+def encode_trace(trace):
+    """트레이스(go.* 객체 또는 dict)의 숫자 배열을 typed array로 바꾼 dict"""
+    if hasattr(trace, "to_plotly_json"):
+        trace = trace.to_plotly_json()
+    return _encode_value(trace)
+
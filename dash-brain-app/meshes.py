@@ -0,0 +1,198 @@
+import os
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from skimage import measure
+
+from volume_cache import artifact_path, cached_artifact
+
+# 두개골 등가면: 평활화 볼륨에서 HU 200, step_size 5
+SKULL_LEVEL = 200
+SKULL_STEP_SIZE = 5
+# 3D 카드에 보내는 두개골 메쉬의 최대 삼각형 수
+SKULL_TRIANGLE_BUDGET = int(os.environ.get("SKULL_TRIANGLE_BUDGET", 20000))
+
+# 병변 메쉬: 먼저 보내는 미리보기(LOD)와 나중에 보내는 전체 해상도
+LESION_LEVEL = 0.5
+LESION_STEP_SIZE = 3
+LESION_PREVIEW_STEP_SIZE = 6
+LESION_PREVIEW_BUDGET = int(os.environ.get("LESION_PREVIEW_BUDGET", 4000))
+# 정점 좌표 양자화 단위 (복셀의 1/16, 이진수로 정확히 표현되어 직렬화가 짧음)
+VERTEX_QUANTUM = 1 / 16
+
+# 메쉬 파일 형식: 헤더(매직, 정점 수, 면 수) + float32 정점 + uint32 면
+MESH_MAGIC = b"CTM1"
+_MESH_HEADER = struct.Struct("<4sII")
+
+# marching cubes가 실패했을 때 쓰는 사면체
+FALLBACK_VERTS = np.array([[0, 0, 0], [0, 0, 1], [0, 1, 0], [1, 0, 0]], dtype=np.float32)
+FALLBACK_FACES = np.array([[0, 1, 2], [0, 2, 3], [0, 3, 1], [1, 3, 2]], dtype=np.uint32)
+
+
+def marching_cubes(volume, level, step_size):
+    """marching cubes 결과 (verts, faces). 등가면이 없거나 격자가 step_size보다 작으면 예외가 납니다."""
+    verts, faces, _, _ = measure.marching_cubes(volume, level, step_size=step_size)
+    return verts, faces
+
+
+def compute_skull_mesh(med_img, level=SKULL_LEVEL, step_size=SKULL_STEP_SIZE):
+    """두개골 등가면 메쉬 (float32 정점, uint32 면)"""
+    try:
+        verts, faces = marching_cubes(med_img, level, step_size)
+    except Exception as e:
+        print(f"marching_cubes 오류: {e}")
+        # 오류 발생 시 기본값 사용
+        return FALLBACK_VERTS, FALLBACK_FACES
+    return verts.astype(np.float32), faces.astype(np.uint32)
+
+
+def _cluster_vertices(verts, faces, cell):
+    """격자 셀 크기 cell로 정점을 묶어 합친 메쉬를 반환합니다 (vertex clustering)."""
+    keys = np.floor((verts - verts.min(axis=0)) / cell).astype(np.int64)
+    dims = keys.max(axis=0) + 1
+    flat = keys[:, 0] + dims[0] * (keys[:, 1] + dims[1] * keys[:, 2])
+    _, cluster = np.unique(flat, return_inverse=True)
+    cluster = cluster.ravel()
+
+    new_faces = cluster[faces]
+    keep = (
+        (new_faces[:, 0] != new_faces[:, 1])
+        & (new_faces[:, 1] != new_faces[:, 2])
+        & (new_faces[:, 0] != new_faces[:, 2])
+    )
+    new_faces = new_faces[keep]
+    # 같은 세 정점을 가진 중복 면 제거 (원래 순서와 방향 유지)
+    _, first = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+    new_faces = new_faces[np.sort(first)]
+
+    # 면에서 쓰이는 묶음만 남기고, 각 묶음의 정점은 평균 위치로
+    used, new_faces = np.unique(new_faces, return_inverse=True)
+    new_faces = new_faces.reshape(-1, 3)
+    counts = np.bincount(cluster)
+    new_verts = np.stack(
+        [np.bincount(cluster, weights=verts[:, d], minlength=counts.size) for d in range(3)], axis=1
+    )
+    new_verts = new_verts[used] / counts[used, None]
+    return new_verts.astype(np.float32), new_faces.astype(np.uint32)
+
+
+def decimate_mesh(verts, faces, target_faces=SKULL_TRIANGLE_BUDGET):
+    """삼각형 수가 target_faces 이하가 될 때까지 격자를 키워가며 정점을 묶습니다."""
+    if len(faces) <= target_faces or len(verts) == 0:
+        return verts, faces
+    verts = np.asarray(verts, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+
+    # 평균 모서리 길이에서 시작해 예산 안에 들어올 때까지 두 배씩
+    edges = verts[faces[:, [1, 2, 0]]] - verts[faces]
+    lo = 0.0
+    hi = float(np.linalg.norm(edges, axis=2).mean())
+    best = _cluster_vertices(verts, faces, hi)
+    while len(best[1]) > target_faces:
+        lo, hi = hi, hi * 2
+        best = _cluster_vertices(verts, faces, hi)
+    # 예산에 가깝게 (너무 거칠지 않게) 셀 크기를 좁힘
+    for _ in range(6):
+        mid = (lo + hi) / 2
+        if mid <= 0:
+            break
+        candidate = _cluster_vertices(verts, faces, mid)
+        if len(candidate[1]) <= target_faces:
+            best, hi = candidate, mid
+        else:
+            lo = mid
+    return best
+
+
+def quantize_vertices(verts, quantum=VERTEX_QUANTUM):
+    """정점 좌표를 quantum 격자로 반올림한 float32 배열"""
+    return (np.round(np.asarray(verts) / quantum) * quantum).astype(np.float32)
+
+
+def lesion_mesh(mask, step_size=LESION_STEP_SIZE, budget=None, offset=(0, 0, 0)):
+    """병변 마스크의 등가면 (양자화된 정점, uint32 면). budget이 있으면 삼각형 수를 제한합니다.
+
+    mask가 볼륨에서 잘라낸 영역이면 offset(잘라낸 영역의 원점)만큼 정점을 옮깁니다.
+    """
+    verts, faces = marching_cubes(mask, LESION_LEVEL, step_size)
+    if budget is not None:
+        verts, faces = decimate_mesh(verts, faces, budget)
+    verts = np.asarray(verts) + np.asarray(offset, dtype=np.float64)
+    return quantize_vertices(verts), np.asarray(faces, dtype=np.uint32)
+
+
+def lesion_preview_mesh(mask, step_size=LESION_PREVIEW_STEP_SIZE, budget=LESION_PREVIEW_BUDGET, offset=(0, 0, 0)):
+    """먼저 보낼 거친 병변 메쉬. 병변이 작아 큰 step_size로 메쉬를 못 만들면 기본 step_size를 씁니다."""
+    if step_size == LESION_STEP_SIZE:
+        return lesion_mesh(mask, step_size, budget, offset)
+    try:
+        verts, faces = lesion_mesh(mask, step_size, budget, offset)
+    except (ValueError, RuntimeError):
+        # 거친 격자가 병변보다 크면 marching_cubes가 면 대신 예외를 냄
+        return lesion_mesh(mask, LESION_STEP_SIZE, budget, offset)
+    if len(faces) == 0:
+        return lesion_mesh(mask, LESION_STEP_SIZE, budget, offset)
+    return verts, faces
+
+
+class PendingMeshes:
+    """전체 해상도 메쉬를 나중에 계산하기 위해 병변 마스크를 잠시 보관하는 LRU
+
+    세그멘테이션 콜백이 미리보기 메쉬와 함께 키를 돌려주고, 후속 콜백이 키로
+    (마스크, 원점) 쌍을 꺼냅니다.
+    """
+
+    def __init__(self, max_items=16):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, mask, offset=(0, 0, 0)):
+        key = uuid.uuid4().hex
+        with self._lock:
+            self._items[key] = (mask, offset)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return key
+
+    def pop(self, key):
+        with self._lock:
+            return self._items.pop(key, None)
+
+
+def save_mesh(f, mesh):
+    """메쉬를 헤더 + float32 정점 + uint32 면 바이너리로 씁니다."""
+    verts = np.ascontiguousarray(mesh[0], dtype="<f4")
+    faces = np.ascontiguousarray(mesh[1], dtype="<u4")
+    f.write(_MESH_HEADER.pack(MESH_MAGIC, len(verts), len(faces)))
+    f.write(verts.tobytes())
+    f.write(faces.tobytes())
+
+
+def load_mesh(path):
+    """save_mesh로 저장한 메쉬를 메모리 매핑으로 읽습니다."""
+    with open(path, "rb") as f:
+        magic, n_verts, n_faces = _MESH_HEADER.unpack(f.read(_MESH_HEADER.size))
+    if magic != MESH_MAGIC:
+        raise ValueError(f"메쉬 파일 형식이 아닙니다: {path}")
+    offset = _MESH_HEADER.size
+    verts = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(n_verts, 3)) if n_verts else np.empty((0, 3), "<f4")
+    offset += n_verts * 3 * 4
+    faces = np.memmap(path, dtype="<u4", mode="r", offset=offset, shape=(n_faces, 3)) if n_faces else np.empty((0, 3), "<u4")
+    return verts, faces
+
+
+def load_skull_mesh(image_name, med_img, level=SKULL_LEVEL, step_size=SKULL_STEP_SIZE,
+                    budget=SKULL_TRIANGLE_BUDGET):
+    """스캔별 두개골 메쉬(삼각형 예산으로 단순화)를 캐시에서 읽거나 계산하여 저장합니다."""
+    return cached_artifact(
+        lambda: artifact_path("skull_mesh", image_name, f"l{level}-s{step_size}-t{budget}", "mesh"),
+        image_name,
+        compute=lambda: decimate_mesh(*compute_skull_mesh(med_img, level, step_size), budget),
+        save=save_mesh,
+        load=load_mesh,
+        label="두개골 메쉬",
+    )
@@ -0,0 +1,152 @@
+import base64
+import io
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import PIL.Image
+from skimage import measure
+
+# 마스크가 없는 슬라이스 (슬라이서 클라이언트는 None인 슬라이스에 오버레이를 그리지 않음)
+EMPTY_OVERLAY = None
+# create_overlay_data의 기본 색 (#D62728, 투명도 100)은 dash-slicer가 슬라이스 값 범위를
+# 0~255로 늘려 인코딩하므로 실제로는 이 RGBA로 그려짐
+OVERLAY_COLOR = (255, 46, 48)
+OVERLAY_ALPHA = 119
+# 현재 슬라이스 앞뒤로 미리 만들어 보낼 오버레이 슬라이스 수
+OVERLAY_PREFETCH = 2
+# 정답 병변 윤곽선 색
+GROUND_TRUTH_COLOR = "lime"
+
+
+def mask_slice_to_uri(mask, color=OVERLAY_COLOR, alpha=OVERLAY_ALPHA):
+    """2D bool 마스크를 1비트 팔레트 PNG data URI로 변환합니다 (0은 투명, 1은 (r, g, b) color)."""
+    height, width = mask.shape
+    im = PIL.Image.frombytes("P", (width, height), np.ascontiguousarray(mask, dtype=np.uint8).tobytes())
+    im.putpalette([0, 0, 0, *color])
+    f = io.BytesIO()
+    im.save(f, format="PNG", bits=1, transparency=bytes([0, alpha]), optimize=True)
+    return "data:image/png;base64," + base64.b64encode(f.getvalue()).decode()
+
+
+def empty_overlay_data(shape, axis):
+    """shape 볼륨의 axis 슬라이서에서 모든 슬라이스가 비어 있는 overlay_data (마스크 배열을 만들지 않음)"""
+    return [EMPTY_OVERLAY] * shape[axis]
+
+
+def _clip_to_volume(mask, offset, shape):
+    """offset 위치의 mask에서 볼륨(shape)과 겹치는 부분과 그 볼륨 좌표 (겹치지 않으면 None)"""
+    src = []
+    dst = []
+    for start, size, length in zip(offset, mask.shape, shape):
+        lo, hi = max(0, start), min(length, start + size)
+        if hi <= lo:
+            return None
+        src.append(slice(lo - start, hi - start))
+        dst.append(slice(lo, hi))
+    return mask[tuple(src)], dst
+
+
+def slice_overlay(shape, axis, mask, offset, index, color=OVERLAY_COLOR):
+    """shape 볼륨의 axis 슬라이서에서 index번 슬라이스 오버레이 (마스크가 없으면 EMPTY_OVERLAY)
+
+    mask는 볼륨에서 offset 위치로 잘라낸 영역이어도 됩니다. 볼륨을 벗어나는 부분은 잘라냅니다.
+    """
+    clipped = _clip_to_volume(mask, offset, shape)
+    if clipped is None:
+        return EMPTY_OVERLAY
+    mask, dst = clipped
+    local = index - dst[axis].start
+    if not 0 <= local < mask.shape[axis]:
+        return EMPTY_OVERLAY
+    mask_plane = np.take(mask, local, axis=axis)
+    if not mask_plane.any():
+        return EMPTY_OVERLAY
+
+    other_axes = tuple(a for a in range(3) if a != axis)
+    plane = np.zeros(tuple(shape[a] for a in other_axes), dtype=bool)
+    plane[tuple(dst[a] for a in other_axes)] = mask_plane
+    return mask_slice_to_uri(plane, color)
+
+
+class LazyOverlays:
+    """세그멘테이션 결과를 서버에 두고 슬라이더 위치 근처 슬라이스의 오버레이만 만드는 저장소
+
+    결과는 (잘라낸 마스크, 원점)으로 키에 보관하고, 인코딩한 슬라이스는
+    (키, 축, 볼륨 크기, 인덱스)를 키로 하는 LRU에 보관합니다.
+    """
+
+    def __init__(self, max_results=8, max_slices=256, prefetch=OVERLAY_PREFETCH):
+        self.max_results = max_results
+        self.max_slices = max_slices
+        self.prefetch = prefetch
+        self._results = OrderedDict()
+        self._slices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, mask, offset=(0, 0, 0)):
+        key = uuid.uuid4().hex
+        with self._lock:
+            self._results[key] = (mask, tuple(offset))
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return key
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._results
+
+    def _slice(self, key, shape, axis, index):
+        cache_key = (key, axis, tuple(shape), index)
+        with self._lock:
+            if cache_key in self._slices:
+                self._slices.move_to_end(cache_key)
+                return self._slices[cache_key]
+            mask, offset = self._results[key]
+        uri = slice_overlay(shape, axis, mask, offset, index)
+        with self._lock:
+            self._slices[cache_key] = uri
+            while len(self._slices) > self.max_slices:
+                self._slices.popitem(last=False)
+        return uri
+
+    def window(self, key, shape, axis, index):
+        """shape 볼륨의 axis 슬라이서에서 index 앞뒤 prefetch 슬라이스 중 마스크가 있는 슬라이스의 {인덱스: 오버레이}"""
+        if index is None or key not in self:
+            return {}
+        nslices = shape[axis]
+        indices = range(max(0, index - self.prefetch), min(nslices, index + self.prefetch + 1))
+        uris = {i: self._slice(key, shape, axis, i) for i in indices}
+        return {i: uri for i, uri in uris.items() if uri is not EMPTY_OVERLAY}
+
+    def overlay_data(self, key, shape, axis, index):
+        """현재 슬라이스 근처만 채운 overlay_data (나머지는 EMPTY_OVERLAY)"""
+        data = empty_overlay_data(shape, axis)
+        for i, uri in self.window(key, shape, axis, index).items():
+            data[i] = uri
+        return data
+
+
+def contour_traces(mask_plane, step, color=GROUND_TRUTH_COLOR):
+    """2D bool 마스크의 윤곽선을 슬라이서 extra_traces용 scatter trace 목록으로 변환합니다.
+
+    step은 (행, 열) 픽셀 간격이며, 슬라이서 좌표는 x = 열 * step[1], y = 행 * step[0]입니다.
+    """
+    if not mask_plane.any():
+        return []
+    # 가장자리에 닿은 영역도 닫힌 윤곽선이 되도록 한 픽셀 여백을 둠
+    padded = np.pad(mask_plane, 1).astype(np.float32)
+    traces = []
+    for contour in measure.find_contours(padded, 0.5):
+        rows, cols = contour[:, 0] - 1, contour[:, 1] - 1
+        traces.append({
+            "type": "scatter",
+            "x": np.round(cols * step[1], 2).tolist(),
+            "y": np.round(rows * step[0], 2).tolist(),
+            "mode": "lines",
+            "line": {"color": color, "width": 2},
+            "hoverinfo": "skip",
+            "showlegend": False,
+        })
+    return traces
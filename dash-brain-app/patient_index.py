@@ -0,0 +1,164 @@
+import copy
+import os
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+DEMOGRAPHICS_COLUMNS = [
+    'Patient_Number', 'Age', 'Gender', 'Intraventricular',
+    'Intraparenchymal', 'Subarachnoid', 'Epidural', 'Subdural',
+    'Fracture', 'Note1'
+]
+HEMORRHAGE_COLUMNS = ['Intraventricular', 'Intraparenchymal', 'Subarachnoid', 'Epidural', 'Subdural']
+HEMORRHAGE_NAMES = ['뇌실내출혈', '뇌실질내출혈', '지주막하출혈', '경막외출혈', '경막하출혈']
+# 슬라이스 라벨 비트셋을 만드는 컬럼 (hemorrhage_diagnosis_raw_ct.csv)
+SLICE_LABEL_COLUMNS = HEMORRHAGE_COLUMNS + ['No_Hemorrhage', 'Fracture_Yes_No']
+
+
+def empty_patient_data(patient_num: Any = '알수없음', note: str = '') -> Dict[str, Any]:
+    return {
+        'patient_num': patient_num,
+        'age': '알수없음',
+        'gender': '알수없음',
+        'hemorrhage_types': [],
+        'fracture': False,
+        'note': note,
+        'detailed_diagnosis': {},
+        'total_slices': 0,
+        'affected_slices': 0
+    }
+
+
+def _parse_age(value):
+    if pd.notna(value) and str(value).replace('.', '').replace('-', '').isdigit():
+        return int(float(value))
+    return '알수없음'
+
+
+class PatientIndex:
+    """환자 번호를 키로 하는 메타데이터 인덱스 (프로세스 시작 시 한 번 생성)
+
+    두 CSV를 한 번만 읽어 환자별 기본 정보, 슬라이스 라벨 비트셋,
+    detailed_diagnosis / fracture_details를 미리 계산해 둡니다.
+    """
+
+    def __init__(self, dataset_dir: str):
+        self.has_demographics = False
+        self._patients: Dict[int, Dict[str, Any]] = {}
+        self._demographics: set = set()
+        # 환자 번호 -> {컬럼: 비트셋}. 비트 k는 k번째 슬라이스(SliceNumber 순서)의 라벨
+        self.slice_bits: Dict[int, Dict[str, int]] = {}
+        self.slice_numbers: Dict[int, List[int]] = {}
+
+        demographics_path = os.path.join(dataset_dir, "Patient_demographics.csv")
+        detailed_diagnosis_path = os.path.join(dataset_dir, "hemorrhage_diagnosis_raw_ct.csv")
+        if os.path.exists(demographics_path):
+            self._load_demographics(demographics_path)
+        if os.path.exists(detailed_diagnosis_path):
+            self._load_slices(detailed_diagnosis_path)
+
+    def _patient(self, patient_num: int) -> Dict[str, Any]:
+        if patient_num not in self._patients:
+            self._patients[patient_num] = empty_patient_data(patient_num)
+        return self._patients[patient_num]
+
+    def _load_demographics(self, path: str) -> None:
+        # CSV 파일의 헤더가 두 줄로 되어 있으므로 수동으로 컬럼명 지정
+        demographics = pd.read_csv(path, skiprows=1)  # 첫 번째 헤더 줄 건너뛰기
+        demographics.columns = DEMOGRAPHICS_COLUMNS
+        self.has_demographics = True
+
+        for row in demographics.to_dict('records'):
+            if pd.isna(row['Patient_Number']):
+                continue
+            patient_num = int(row['Patient_Number'])
+            if patient_num in self._demographics:
+                continue  # 중복 행은 첫 번째 행만 사용
+            self._demographics.add(patient_num)
+
+            patient_data = self._patient(patient_num)
+            patient_data['age'] = _parse_age(row['Age'])
+            patient_data['gender'] = row['Gender'] if pd.notna(row['Gender']) else '알수없음'
+            patient_data['fracture'] = bool(pd.notna(row['Fracture']) and row['Fracture'] == 1)
+            patient_data['note'] = row['Note1'] if pd.notna(row['Note1']) else ''
+            patient_data['hemorrhage_types'] = [
+                name for col, name in zip(HEMORRHAGE_COLUMNS, HEMORRHAGE_NAMES)
+                if pd.notna(row[col]) and row[col] == 1
+            ]
+
+    def _load_slices(self, path: str) -> None:
+        detailed_data = pd.read_csv(path)
+        for patient_num, patient_slices in detailed_data.groupby('PatientNumber', sort=False):
+            patient_num = int(patient_num)
+            patient_data = self._patient(patient_num)
+            total = len(patient_slices)
+            patient_data['total_slices'] = total
+
+            slice_numbers = patient_slices['SliceNumber'].tolist()
+            bits = {}
+            for col in SLICE_LABEL_COLUMNS:
+                flags = (patient_slices[col] == 1).to_numpy()
+                bits[col] = sum(1 << k for k, flag in enumerate(flags) if flag)
+            self.slice_bits[patient_num] = bits
+            self.slice_numbers[patient_num] = slice_numbers
+
+            # 각 출혈 타입별 영향받은 슬라이스 수 계산
+            for col, name in zip(HEMORRHAGE_COLUMNS, HEMORRHAGE_NAMES):
+                slice_range = self.slices_with(patient_num, col)
+                if slice_range:
+                    patient_data['detailed_diagnosis'][name] = {
+                        'affected_slices': len(slice_range),
+                        'percentage': round((len(slice_range) / total) * 100, 1),
+                        'slice_range': slice_range
+                    }
+
+            # 전체 영향받은 슬라이스 수 (출혈이 있는 슬라이스)
+            patient_data['affected_slices'] = int((patient_slices['No_Hemorrhage'] == 0).sum())
+
+            # 골절 정보 (슬라이스별)
+            fracture_slices = bin(bits['Fracture_Yes_No']).count('1')
+            if fracture_slices > 0:
+                patient_data['fracture_details'] = {
+                    'affected_slices': fracture_slices,
+                    'percentage': round((fracture_slices / total) * 100, 1)
+                }
+
+    def __contains__(self, patient_num: int) -> bool:
+        return patient_num in self._patients
+
+    def has_demographics_for(self, patient_num: int) -> bool:
+        return patient_num in self._demographics
+
+    def slices_with(self, patient_num: int, column: str) -> List[int]:
+        """해당 라벨이 1인 슬라이스 번호 목록"""
+        bits = self.slice_bits.get(patient_num, {}).get(column, 0)
+        numbers = self.slice_numbers.get(patient_num, [])
+        return [n for k, n in enumerate(numbers) if bits >> k & 1]
+
+    def get(self, patient_num: int) -> Dict[str, Any]:
+        """환자 정보 딕셔너리의 복사본 (없는 환자는 기본값)"""
+        patient_data = self._patients.get(patient_num)
+        if patient_data is None:
+            return empty_patient_data(patient_num)
+        return copy.deepcopy(patient_data)
+
+    def dropdown_label(self, patient_num: int) -> str:
+        """이미지 선택 드롭다운에 표시할 라벨"""
+        if not self.has_demographics:
+            return f"환자 {patient_num}"
+        if patient_num not in self._demographics:
+            return f"환자 {patient_num} (정보없음)"
+        patient_data = self._patients[patient_num]
+        hemorrhage_str = ', '.join(patient_data['hemorrhage_types']) if patient_data['hemorrhage_types'] else '정상'
+        return f"환자 {patient_num} (나이 : {patient_data['age']}세, 성별 : {patient_data['gender']}, 진단 : {hemorrhage_str})"
+
+    def patient_nums(self) -> List[int]:
+        return sorted(self._patients)
+
+
+def load_patient_index(dataset_dir: str) -> Optional[PatientIndex]:
+    try:
+        return PatientIndex(dataset_dir)
+    except Exception as e:
+        print(f"메타데이터 로드 오류: {e}")
+        return None
@@ -0,0 +1,105 @@
+"""모든 CT 스캔의 캐시를 미리 채우는 배치 파이프라인
+
+SHA256SUMS.txt에 있는 ct_scans/*.nii 각각에 대해 재배열된 볼륨, 평활화 볼륨,
+전체 HU 히스토그램, 관심 영역 히스토그램 인덱스, 뇌 윈도우 슬라이스 피라미드(전체 해상도와 미리보기 레벨), 정답 병변 마스크, 두개골 메쉬를 만들어 캐시 디렉토리에 저장합니다.
+이미 있는 결과는 건너뛰므로 중단 후 다시 실행해도 됩니다.
+
+사용법: python precompute.py [--workers N] [--force] [--verify] [049.nii ...]
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import time
+
+from meshes import load_skull_mesh
+from roi_histogram import load_histogram_index
+from slice_pyramid import load_slice_pyramid
+from volume_cache import (
+    DEFAULT_IMAGE,
+    DEFAULT_IMAGE_NAME,
+    clear_scan_cache,
+    image_path,
+    load_cached_volume,
+    load_histogram,
+    load_lesion_mask,
+    load_smoothed,
+    read_checksums,
+    require_verified_dataset,
+)
+
+
+def scans_to_precompute():
+    """SHA256SUMS.txt에 있고 디스크에도 있는 CT 스캔 (앱이 시작할 때 읽는 기본 샘플 포함)"""
+    names = []
+    missing = 0
+    if os.path.exists(DEFAULT_IMAGE):
+        names.append(DEFAULT_IMAGE_NAME)
+    for rel_path in sorted(read_checksums()):
+        folder, _, name = rel_path.partition("/")
+        if folder != "ct_scans":
+            continue
+        if os.path.exists(image_path(name)):
+            names.append(name)
+        else:
+            missing += 1
+    if missing:
+        print(f"⚠️ SHA256SUMS.txt에는 있지만 디스크에 없는 스캔 {missing}개를 건너뜁니다.")
+    return names
+
+
+def precompute_scan(image_name, force=False):
+    """한 스캔의 모든 캐시를 채우고 걸린 시간을 반환합니다 (작업 프로세스에서 실행)."""
+    t_start = time()
+    if force:
+        clear_scan_cache(image_name)
+    img, _ = load_cached_volume(image_name)
+    med_img = load_smoothed(image_name, img)
+    load_histogram(image_name, med_img)
+    load_histogram_index(image_name, med_img)
+    load_slice_pyramid(image_name, img)
+    load_lesion_mask(image_name)
+    load_skull_mesh(image_name, med_img)
+    return time() - t_start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CT 스캔 캐시 미리 생성")
+    parser.add_argument("scans", nargs="*", help="처리할 스캔 (기본: SHA256SUMS.txt의 모든 스캔)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="작업 프로세스 수")
+    parser.add_argument("--force", action="store_true", help="기존 캐시를 지우고 다시 계산")
+    parser.add_argument("--verify", action="store_true", help="먼저 SHA256SUMS.txt로 데이터셋을 검증 (바뀐 파일만 다시 해시)")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        try:
+            require_verified_dataset()
+        except RuntimeError as e:
+            print(f"❌ 데이터셋 검증 실패: {e}")
+            return 1
+
+    names = args.scans or scans_to_precompute()
+    if not names:
+        print("처리할 CT 스캔이 없습니다.")
+        return 0
+
+    t_start = time()
+    failed = []
+    print(f"🔄 {len(names)}개 스캔 캐시 생성 (프로세스 {args.workers}개)")
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(precompute_scan, name, args.force): name for name in names}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                elapsed = future.result()
+                print(f"✅ [{done}/{len(names)}] {name} ({elapsed:.1f}s)")
+            except Exception as e:
+                failed.append(name)
+                print(f"❌ [{done}/{len(names)}] {name}: {e}")
+
+    print(f"완료: {len(names) - len(failed)}개 성공, {len(failed)}개 실패, {time() - t_start:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import numpy as np
+
+from volume_cache import artifact_path, cached_artifact
+
+# 인덱스 타일 크기 (픽셀). 512x512 슬라이스는 8x8 타일
+HISTOGRAM_TILE = 64
+# 정수 HU 범위가 이보다 넓으면 인덱스를 만들지 않고 직접 계산
+MAX_HU_BINS = 1 << 14
+# 관심 영역 히스토그램 구간 수 (exposure.histogram 기본값)
+ROI_NBINS = 256
+
+
+class HistogramIndex:
+    """슬라이스별 타일 정수 HU 히스토그램의 행 방향 누적합 (integral histogram)
+
+    prefix[z, ty, tx, v - vmin]은 슬라이스 z의 타일 행 ty에서 0..tx-1번 타일에 있는
+    HU 값 v의 개수입니다. 관심 영역이 완전히 덮는 타일은 누적합의 차로 한 번에 더하고,
+    경계 타일의 픽셀만 직접 셉니다.
+    """
+
+    def __init__(self, prefix, vmin, tile=HISTOGRAM_TILE):
+        self.prefix = prefix
+        self.vmin = int(vmin)
+        self.tile = tile
+
+    @property
+    def nbins(self):
+        return self.prefix.shape[-1]
+
+    @property
+    def nbytes(self):
+        return self.prefix.nbytes
+
+    @classmethod
+    def build(cls, med_img, tile=HISTOGRAM_TILE):
+        """정수 HU 볼륨에서 인덱스를 만듭니다. 만들 수 없으면 None"""
+        if med_img.dtype.kind not in "iu" or med_img.size == 0:
+            return None
+        vmin, vmax = int(med_img.min()), int(med_img.max())
+        nbins = vmax - vmin + 1
+        if nbins > MAX_HU_BINS:
+            return None
+
+        depth, height, width = med_img.shape
+        ty, tx = -(-height // tile), -(-width // tile)
+        # 누적합의 최댓값은 타일 한 행의 픽셀 수
+        dtype = np.uint16 if tx * tile * tile <= np.iinfo(np.uint16).max else np.uint32
+        tile_ids = (np.arange(height) // tile)[:, None] * tx + (np.arange(width) // tile)[None, :]
+        keys = tile_ids.ravel().astype(np.int64) * nbins
+
+        prefix = np.zeros((depth, ty, tx + 1, nbins), dtype=dtype)
+        for z in range(depth):
+            values = med_img[z].ravel().astype(np.int64) - vmin
+            counts = np.bincount(keys + values, minlength=ty * tx * nbins).reshape(ty, tx, nbins)
+            np.cumsum(counts, axis=1, out=prefix[z, :, 1:])
+        return cls(prefix, vmin, tile)
+
+    def _full_tiles(self, roi_mask):
+        """관심 영역이 완전히 덮는 타일 (ty, tx) bool 격자와 그 타일들의 픽셀 마스크"""
+        height, width = roi_mask.shape
+        ty, tx = self.prefix.shape[1], self.prefix.shape[2] - 1
+        padded = np.zeros((ty * self.tile, tx * self.tile), dtype=bool)
+        padded[:height, :width] = roi_mask
+        covered = padded.reshape(ty, self.tile, tx, self.tile).sum(axis=(1, 3))
+        # 가장자리 타일은 실제 픽셀 수와 비교
+        rows = np.minimum(self.tile, height - np.arange(ty) * self.tile)
+        cols = np.minimum(self.tile, width - np.arange(tx) * self.tile)
+        full = covered == rows[:, None] * cols[None, :]
+        full_pixels = np.repeat(np.repeat(full, self.tile, axis=0), self.tile, axis=1)[:height, :width]
+        return full, full_pixels
+
+    def roi_counts(self, med_img, roi_mask, top, bottom):
+        """med_img[top:bottom, roi_mask]의 정수 HU별 개수 (길이 nbins, 인덱스 0이 vmin)"""
+        top, bottom, _ = slice(top, bottom).indices(med_img.shape[0])
+        counts = np.zeros(self.nbins, dtype=np.int64)
+        if bottom <= top:
+            return counts
+
+        full, full_pixels = self._full_tiles(roi_mask)
+        # 타일 행마다 완전히 덮인 타일이 이어지는 구간 [start, end)를 누적합의 차로 더함
+        edges = np.diff(np.pad(full.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+        for row in range(full.shape[0]):
+            starts = np.flatnonzero(edges[row] == 1)
+            ends = np.flatnonzero(edges[row] == -1)
+            for start, end in zip(starts, ends):
+                counts += self.prefix[top:bottom, row, end].sum(axis=0, dtype=np.int64)
+                counts -= self.prefix[top:bottom, row, start].sum(axis=0, dtype=np.int64)
+
+        # 경계 타일의 픽셀은 직접 셈
+        boundary = roi_mask & ~full_pixels
+        if boundary.any():
+            values = med_img[top:bottom, boundary].ravel().astype(np.int64) - self.vmin
+            counts += np.bincount(values, minlength=self.nbins)
+        return counts
+
+
+def save_histogram_index(f, index):
+    np.save(f, index.prefix)
+
+
+def load_histogram_index(image_name, med_img, tile=HISTOGRAM_TILE):
+    """스캔별 관심 영역 히스토그램 인덱스를 캐시에서 읽거나 만들어 저장합니다. 정수 볼륨이 아니면 None"""
+    if med_img.dtype.kind not in "iu" or med_img.size == 0:
+        return None
+    vmin, vmax = int(med_img.min()), int(med_img.max())
+    if vmax - vmin + 1 > MAX_HU_BINS:
+        return None
+    return cached_artifact(
+        lambda: artifact_path("roi_histogram", image_name, f"t{tile}", "npy"),
+        image_name,
+        compute=lambda: HistogramIndex.build(med_img, tile),
+        save=save_histogram_index,
+        load=lambda path: HistogramIndex(np.load(path, mmap_mode="r"), vmin, tile),
+        label="관심 영역 히스토그램 인덱스",
+    )
+
+
+def roi_histogram(med_img, roi_mask, top, bottom, index=None, nbins=ROI_NBINS):
+    """exposure.histogram(med_img[top:bottom, roi_mask].astype(np.float32))과 같은 (빈도, 구간 중심)
+
+    index가 있으면 정수 HU별 개수를 인덱스로 모은 뒤 같은 구간으로 다시 나눕니다.
+    관심 영역에 복셀이 없으면 None을 반환합니다.
+    """
+    if index is None:
+        intensities = med_img[top:bottom, roi_mask].ravel()
+        if len(intensities) == 0:
+            return None
+        values, counts = np.unique(intensities, return_counts=True)
+    else:
+        counts = index.roi_counts(med_img, roi_mask, top, bottom)
+        present = np.flatnonzero(counts)
+        if len(present) == 0:
+            return None
+        values, counts = present + index.vmin, counts[present]
+
+    # 서로 다른 값마다 개수를 가중치로 주면 원래 복셀로 만든 히스토그램과 구간 배정이 같음
+    hist, bin_edges = np.histogram(values.astype(np.float32), bins=nbins, weights=counts)
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2.0
+    return hist.astype(np.int64), bin_centers
@@ -0,0 +1,84 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import ndimage
+from skimage import draw
+
+# SVG 경로의 숫자 (부호, 소수점, 지수 표기 포함)
+_NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+def path_to_coords(path):
+    """From SVG path to numpy array of coordinates, each row being a (row, col) point"""
+    return np.array(_NUMBER_RE.findall(path), dtype=float).reshape(-1, 2)
+
+
+def polygon_mask(path, spacing, shape):
+    """수평(axial) 뷰에 그린 SVG 경로를 (행, 열) 크기의 채워진 bool 마스크로 변환합니다.
+
+    폴리곤 경계 상자 안에서만 래스터화하고 구멍을 채웁니다. 유효한 폴리곤이 없으면 None을 반환합니다.
+    """
+    path = path_to_coords(path)
+    if len(path) == 0:
+        print("오류: 유효한 폴리곤 좌표가 없습니다.")
+        return None
+
+    # 좌표 계산 및 경계 확인
+    r_coords = path[:, 1] / spacing[1]
+    c_coords = path[:, 0] / spacing[2]
+
+    # 이미지 크기 가져오기
+    height, width = shape
+
+    # 폴리곤 좌표 생성 전에 경계 내에 있는지 확인
+    if np.any(r_coords < 0) or np.any(r_coords >= height) or np.any(c_coords < 0) or np.any(c_coords >= width):
+        print(f"경고: 일부 좌표가 이미지 경계를 벗어났습니다. 경계 내로 제한합니다.")
+        r_coords = np.clip(r_coords, 0, height - 1)
+        c_coords = np.clip(c_coords, 0, width - 1)
+
+    # 경계 상자 기준 좌표로 옮겨 작은 캔버스에 폴리곤 생성
+    r0, c0 = int(np.floor(r_coords.min())), int(np.floor(c_coords.min()))
+    r1 = min(height, int(np.ceil(r_coords.max())) + 1)
+    c1 = min(width, int(np.ceil(c_coords.max())) + 1)
+    rr, cc = draw.polygon(r_coords - r0, c_coords - c0, shape=(r1 - r0, c1 - c0))
+    if len(rr) == 0 or len(cc) == 0:
+        print("오류: 유효한 폴리곤 좌표가 없습니다.")
+        return None
+
+    box = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+    box[rr, cc] = True
+    mask = np.zeros(shape, dtype=bool)
+    # 경계 상자 밖은 모두 배경이므로 상자 안에서 구멍을 채워도 결과가 같음
+    mask[r0:r1, c0:c1] = ndimage.binary_fill_holes(box)
+    return mask
+
+
+class RoiMasks:
+    """SVG 경로를 키로 래스터화한 관심 영역 마스크를 보관하는 LRU
+
+    히스토그램과 세그멘테이션 콜백이 같은 관심 영역 편집에 대해 마스크를 한 번만 만듭니다.
+    반환하는 마스크는 공유되므로 읽기 전용입니다.
+    """
+
+    def __init__(self, max_items=32):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, spacing, shape):
+        key = (path, float(spacing[1]), float(spacing[2]), tuple(shape))
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        mask = polygon_mask(path, spacing, shape)
+        if mask is not None:
+            mask.flags.writeable = False
+        with self._lock:
+            self._items[key] = mask
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return mask
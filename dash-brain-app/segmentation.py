@@ -0,0 +1,181 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import ndimage
+from skimage.segmentation import flood
+
+from meshes import LESION_PREVIEW_STEP_SIZE, LESION_STEP_SIZE
+from roi_mask import RoiMasks
+
+# 병변 마스크 평활화(median) footprint: 축방향 7x7
+LESION_SMOOTH_FOOTPRINT = np.ones((1, 7, 7))
+# 잘라낸 영역의 원점을 marching cubes step_size의 배수에 맞춰 전체 볼륨과 같은 격자를 샘플링
+CROP_ALIGN = int(np.lcm(LESION_STEP_SIZE, LESION_PREVIEW_STEP_SIZE))
+# 잘라낸 영역 가장자리의 여백: median 반경과 marching cubes 한 칸 이상
+CROP_MARGIN = max(LESION_SMOOTH_FOOTPRINT.shape[1] // 2, LESION_STEP_SIZE, LESION_PREVIEW_STEP_SIZE) + 1
+
+
+def label_components(mask):
+    """ndimage.label과 같은 라벨을 가능한 한 uint16 배열로 만듭니다 (int32 대비 메모리 절반)."""
+    try:
+        labels = np.empty(mask.shape, dtype=np.uint16)
+        n = ndimage.label(mask, output=labels)
+    except RuntimeError:
+        # 연결 성분이 65535개를 넘으면 int32로
+        labels, n = ndimage.label(mask)
+    return labels, n
+
+
+def nearest_voxel(mask, point, spacing=(1, 1, 1)):
+    """mask에서 point와 (물리 거리 기준) 가장 가까운 True 복셀의 인덱스"""
+    coords = np.nonzero(mask)
+    dist = sum(((c - p) * s) ** 2 for c, p, s in zip(coords, point, spacing))
+    i = int(np.argmin(dist))
+    return tuple(int(c[i]) for c in coords)
+
+
+def largest_connected_component(mask, seed=None):
+    """mask의 가장 큰 연결 성분 (면 연결). seed를 주면 seed 복셀이 속한 성분만 채웁니다."""
+    if seed is not None:
+        return flood(mask.view(np.uint8), seed, connectivity=1)
+    labels, n = label_components(mask)
+    if n == 1:
+        return mask.astype(bool, copy=True)
+    sizes = np.bincount(labels.ravel())[1:]
+    return labels == (np.argmax(sizes) + 1)
+
+
+def slab_bounds(annotations, spacing, depth):
+    """정면(sagittal) 뷰에 그린 사각형의 위/아래를 슬라이스 번호 [top, bottom)으로 변환합니다."""
+    # top and bottom, the top is a lower number than the bottom because y values
+    # increase moving down the figure
+    top, bottom = sorted(
+        [int(annotations["x"][c] / spacing[0]) for c in ["y0", "y1"]]
+    )
+
+    # 이미지 높이 범위 확인 및 조정
+    if top < 0 or bottom >= depth:
+        print(f"경고: 높이 범위({top}, {bottom})가 이미지 높이({depth})를 벗어났습니다. 범위를 조정합니다.")
+        top = max(0, min(top, depth-1))
+        bottom = max(0, min(bottom, depth-1))
+        if top >= bottom:
+            bottom = min(top + 1, depth-1)
+    return top, bottom
+
+
+def _crop_bounds(start, stop, size):
+    """[start, stop) 구간을 여백만큼 넓히고 시작점을 CROP_ALIGN 배수로 내린 구간"""
+    lo = max(0, start - CROP_MARGIN)
+    lo -= lo % CROP_ALIGN
+    hi = min(size, stop + CROP_MARGIN)
+    return lo, hi
+
+
+class SegmentationSession:
+    """한 관심 영역(볼륨, 폴리곤, 슬라이스 범위)에 대한 세그멘테이션 상태
+
+    모든 계산은 폴리곤 경계 상자 × 슬라이스 범위(+여백)로 잘라낸 작은 영역에서 합니다.
+    관심 영역 안 복셀의 위치를 HU 값 순으로 정렬해 두므로, HU 범위만 바뀌면
+    searchsorted 두 번으로 임계값 마스크를 만들 수 있습니다.
+    """
+
+    def __init__(self, volume, roi_mask, top, bottom):
+        self.shape = volume.med_img.shape
+        self.spacing = volume.spacing
+        self.roi_mask = roi_mask
+        self.top = top
+        self.bottom = bottom
+
+        # 잘라낼 영역: 폴리곤 경계 상자와 슬라이스 범위에 여백을 더함
+        rows = np.flatnonzero(roi_mask.any(axis=1))
+        cols = np.flatnonzero(roi_mask.any(axis=0))
+        bounds = [
+            _crop_bounds(top, bottom, self.shape[0]),
+            _crop_bounds(int(rows[0]), int(rows[-1]) + 1, self.shape[1]),
+            _crop_bounds(int(cols[0]), int(cols[-1]) + 1, self.shape[2]),
+        ]
+        self.box = tuple(slice(lo, hi) for lo, hi in bounds)
+        self.offset = tuple(lo for lo, _ in bounds)
+        self.crop_shape = tuple(hi - lo for lo, hi in bounds)
+
+        # 슬라이스 범위 × 폴리곤 안의 복셀 (잘라낸 영역 기준 평면 인덱스)
+        slab = np.zeros(self.crop_shape, dtype=bool)
+        slab[top - self.offset[0]:bottom - self.offset[0], roi_mask[self.box[1:]]] = True
+        indices = np.flatnonzero(slab)
+        values = volume.med_img[self.box].ravel()[indices]
+        order = np.argsort(values, kind="stable")
+        self.sorted_values = values[order]
+        self.sorted_indices = indices[order]
+
+        # 관심 영역의 중심 (잘라낸 영역 기준, seed 모드에서 사용)
+        roi_rows, roi_cols = np.nonzero(roi_mask)
+        self.center = (
+            (top + bottom - 1) / 2 - self.offset[0],
+            roi_rows.mean() - self.offset[1],
+            roi_cols.mean() - self.offset[2],
+        )
+
+        # 마지막 ((v_min, v_max, seeded), 결과 마스크)
+        self._last = (None, None)
+
+    def threshold(self, v_min, v_max):
+        """관심 영역 안에서 v_min < HU <= v_max 인 복셀 마스크 (잘라낸 영역 크기)"""
+        lo = np.searchsorted(self.sorted_values, v_min, side="right")
+        hi = np.searchsorted(self.sorted_values, v_max, side="right")
+        img_mask = np.zeros(self.crop_shape, dtype=bool)
+        img_mask.ravel()[self.sorted_indices[lo:hi]] = True
+        return img_mask
+
+    def segment(self, v_min, v_max, seeded=False):
+        """임계값 마스크의 가장 큰 연결 성분. 같은 HU 범위를 다시 요청하면 이전 결과를 돌려줍니다.
+
+        seeded이면 라벨링 대신 관심 영역 중심에 가장 가까운 복셀에서 flood fill한 성분을 반환합니다.
+        """
+        last_key, last_mask = self._last
+        if last_key == (v_min, v_max, seeded):
+            return last_mask
+        img_mask = self.threshold(v_min, v_max)
+        if img_mask.any():
+            seed = nearest_voxel(img_mask, self.center, self.spacing) if seeded else None
+            img_mask = largest_connected_component(img_mask, seed)
+        self._last = ((v_min, v_max, seeded), img_mask)
+        return img_mask
+
+    def full_mask(self, crop_mask):
+        """잘라낸 영역의 마스크를 볼륨 크기 마스크에 붙여 넣습니다 (오버레이용)."""
+        mask = np.zeros(self.shape, dtype=bool)
+        mask[self.box] = crop_mask
+        return mask
+
+
+class SegmentationSessions:
+    """(볼륨, 폴리곤 경로, 슬라이스 범위)를 키로 하는 세그멘테이션 세션 LRU"""
+
+    def __init__(self, roi_masks=None, max_items=8):
+        self.roi_masks = roi_masks if roi_masks is not None else RoiMasks()
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, volume, annotations):
+        """annotations에 해당하는 세션 (관심 영역이 유효하지 않으면 None)"""
+        depth, height, width = volume.med_img.shape
+        top, bottom = slab_bounds(annotations, volume.spacing, depth)
+        path = annotations["z"]["path"]
+        key = (volume.name, path, top, bottom)
+        with self._lock:
+            session = self._items.get(key)
+            if session is not None:
+                self._items.move_to_end(key)
+                return session
+
+        roi_mask = self.roi_masks.get(path, volume.spacing, (height, width))
+        if roi_mask is None:
+            return None
+        session = SegmentationSession(volume, roi_mask, top, bottom)
+        with self._lock:
+            self._items[key] = session
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return session
@@ -0,0 +1,192 @@
+import os
+import threading
+from collections import OrderedDict
+
+import dash
+import numpy as np
+from dash.dependencies import Input, Output, State
+from dash_slicer import VolumeSlicer
+
+from volume_cache import artifact_path, cached_artifact
+from windowing import BRAIN_WINDOW, apply_window, window_bounds
+
+# 슬라이스 피라미드 레벨 (슬라이스 평면의 긴 변 픽셀 수). 레벨은 처음 요청될 때만 만듭니다.
+PYRAMID_LEVELS = (128, 256, 512)
+# 슬라이더를 움직이는 동안 보여줄 레벨 (슬라이더가 멈추면 전체 해상도)
+SLICE_PREVIEW_LEVEL = int(os.environ.get("SLICE_PREVIEW_LEVEL", 128))
+
+
+def _level_factor(shape, level, axis=0):
+    """axis 슬라이스 평면의 긴 변이 level 이하가 되는 정수 축소 배율"""
+    plane = [n for a, n in enumerate(shape) if a != axis]
+    return max(1, -(-max(plane) // level))
+
+
+def downsample_plane(volume, factor, axis=0):
+    """axis에 수직인 슬라이스 평면만 factor x factor 블록 평균으로 줄입니다 (axis 방향 슬라이스 수는 유지)."""
+    if factor == 1:
+        return volume
+    moved = np.moveaxis(volume, axis, 0)
+    depth, height, width = moved.shape
+    h, w = -(-height // factor), -(-width // factor)
+    padded = np.pad(moved, ((0, 0), (0, h * factor - height), (0, w * factor - width)), mode="edge")
+    blocks = padded.reshape(depth, h, factor, w, factor).astype(np.float32)
+    level = np.round(blocks.mean(axis=(2, 4))).astype(np.uint8)
+    return np.ascontiguousarray(np.moveaxis(level, 0, axis))
+
+
+def save_level(f, level):
+    np.save(f, level)
+
+
+def load_slice_pyramid(image_name, img, window=BRAIN_WINDOW, levels=(SLICE_PREVIEW_LEVEL,), axes=(0, 1)):
+    """윈도우를 적용한 uint8 슬라이스 피라미드 {0 또는 (레벨, 축): 볼륨 배열}
+
+    전체 해상도(배율 1)는 0으로 함께 반환합니다. (레벨, 축) 배열은 그 축의 슬라이스 평면만 줄이므로
+    슬라이스 수가 전체 해상도와 같습니다. 레벨과 축마다 캐시에서 읽거나 만들어 저장하며,
+    기본값은 두 슬라이서(축 0, 1)가 쓰는 미리보기 레벨뿐입니다.
+    """
+    w_level, w_width = window
+    windowed = None
+
+    def full():
+        nonlocal windowed
+        if windowed is None:
+            windowed = apply_window(img, w_level, w_width)
+        return windowed
+
+    def load_level(level, factor, axis=0):
+        params = f"w{w_level:g}-{w_width:g}-f{factor}" + (f"-a{axis}" if factor > 1 else "")
+        return cached_artifact(
+            lambda: artifact_path("slices", image_name, params, "npy"),
+            image_name,
+            compute=lambda: downsample_plane(full(), factor, axis),
+            save=save_level,
+            load=lambda path: np.load(path, mmap_mode="r"),
+            label=f"슬라이스 피라미드 ({level}, 축 {axis})",
+        )
+
+    pyramid = {0: load_level("전체", 1)}
+    for level in levels:
+        for axis in axes:
+            factor = _level_factor(img.shape, level, axis)
+            # 슬라이스 평면이 레벨보다 작으면 전체 해상도를 그대로 사용
+            pyramid[level, axis] = pyramid[0] if factor == 1 else load_level(level, factor, axis)
+    return pyramid
+
+
+class SlicePyramids:
+    """(이미지 이름, 윈도우)를 키로 슬라이스 피라미드를 보관하는 LRU
+
+    피라미드에는 요청된 (레벨, 축)만 들어 있고, 다른 레벨(예: /tiles의 256)이 요청되면 그때 추가합니다.
+    """
+
+    def __init__(self, volume_getter, max_items=8):
+        self._volume_getter = volume_getter
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, image_name, window=BRAIN_WINDOW, level=0, axis=0):
+        """axis 슬라이서용 level 볼륨 배열 (0은 전체 해상도, 축과 무관)"""
+        key = (image_name, tuple(window))
+        entry = (level, axis) if level else 0
+        with self._lock:
+            pyramid = self._items.get(key)
+            if pyramid is not None:
+                self._items.move_to_end(key)
+                if entry in pyramid:
+                    return pyramid[entry]
+            load_lock = self._loading.setdefault((key, entry), threading.Lock())
+
+        # 같은 레벨은 한 번만 만들고, 동시에 요청한 콜백은 그 결과를 기다림
+        with load_lock:
+            try:
+                with self._lock:
+                    pyramid = self._items.get(key)
+                    if pyramid is not None and entry in pyramid:
+                        return pyramid[entry]
+                levels = (level,) if level else ()
+                loaded = load_slice_pyramid(image_name, self._volume_getter(image_name).img, window, levels, (axis,))
+                with self._lock:
+                    pyramid = self._items.setdefault(key, {})
+                    pyramid.update(loaded)
+                    self._items.move_to_end(key)
+                    while len(self._items) > self.max_items:
+                        self._items.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._loading.pop((key, entry), None)
+        return loaded[entry]
+
+
+def clim_to_window(clim):
+    """슬라이서 clim (w_min, w_max)을 윈도우 (level, width)로 변환합니다."""
+    w_min, w_max = min(clim), max(clim)
+    return (w_min + w_max) / 2, w_max - w_min
+
+
+class PyramidVolumeSlicer(VolumeSlicer):
+    """슬라이스 피라미드에서 미리 인코딩한 이미지를 보내는 VolumeSlicer
+
+    슬라이더를 움직이는 동안은 preview_level 썸네일을 보여주고,
+    슬라이더가 멈추면 dash-slicer의 요청 경로로 전체 해상도 슬라이스를 보냅니다.
+    이미지는 tiles(slice_tiles.SliceTiles)에서 가져오므로 다시 인코딩하지 않습니다.
+    volume_key_id 저장소의 이미지 이름이 바뀌면 썸네일도 그 스캔으로 바꾸고,
+    윈도우는 슬라이서의 clim 저장소 값을 따릅니다.
+    """
+
+    def __init__(self, app, volume, tiles, image_name, volume_key_id, window=BRAIN_WINDOW,
+                 preview_level=SLICE_PREVIEW_LEVEL, **kwargs):
+        if preview_level not in PYRAMID_LEVELS:
+            raise ValueError(f"preview_level은 {PYRAMID_LEVELS} 중 하나여야 합니다: {preview_level}")
+        self._tiles = tiles
+        self._image_name = image_name
+        self._volume_key_id = volume_key_id
+        self._preview_level = preview_level
+        super().__init__(app, volume, thumbnail=False, clim=window_bounds(*window), **kwargs)
+
+    def _source(self, volume_key, clim=None):
+        """(이미지 이름, 윈도우)"""
+        return volume_key or self._image_name, clim_to_window(clim or self._initial_clim)
+
+    def _create_dash_components(self):
+        # 클라이언트가 썸네일을 전체 크기로 늘려 그릴 수 있도록 미리보기 레벨의 슬라이스 크기를 알려줌
+        preview = self._tiles.pyramids.get(*self._source(None), self._preview_level, self._axis)
+        h, w = np.take(preview, 0, axis=self._axis).shape
+        self._slice_info["thumbnail_size"] = [w, h]
+        super()._create_dash_components()
+
+    def _create_server_callbacks(self):
+        app = self._app
+
+        @app.callback(
+            Output(self._thumbs_data.id, "data"),
+            [Input(self._clim.id, "data"), Input(self._volume_key_id, "data")],
+        )
+        def upload_thumbnails(clim, volume_key):
+            image_name, window = self._source(volume_key, clim)
+            return self._tiles.data_uris(image_name, window, self._preview_level, self._axis)
+
+        @app.callback(
+            Output(self._server_data.id, "data"),
+            [Input(self._state.id, "data"), Input(self._clim.id, "data"), Input(self._volume_key_id, "data")],
+            [State(self._slider.id, "value")],
+        )
+        def upload_requested_slice(state, clim, volume_key, slider_index):
+            triggered = dash.callback_context.triggered_id
+            if triggered in (self._clim.id, self._volume_key_id):
+                # 스캔이나 윈도우가 바뀌면 현재 위치의 전체 해상도 슬라이스를 다시 보냄
+                index = slider_index
+            elif state is None or not state["index_changed"]:
+                return dash.no_update
+            else:
+                index = state["index"]
+            if index is None:
+                return dash.no_update
+            image_name, window = self._source(volume_key, clim)
+            uri = self._tiles.data_uri(image_name, window, 0, self._axis, index)
+            if uri is None:
+                return dash.no_update
+            return {"index": index, "slice": uri}
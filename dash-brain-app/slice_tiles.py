@@ -0,0 +1,127 @@
+import base64
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import PIL.Image
+
+from slice_pyramid import PYRAMID_LEVELS
+from volume_cache import artifact_path, cached_artifact, source_digest
+from windowing import BRAIN_WINDOW
+
+# 타일 형식별 MIME 타입 (PNG는 dash-slicer가 보내는 것과 같은 인코딩, WebP는 무손실)
+TILE_FORMATS = {"png": "image/png", "webp": "image/webp"}
+# URL의 레벨 이름 -> 피라미드 레벨 (0은 전체 해상도)
+TILE_LEVELS = {"full": 0, **{str(level): level for level in PYRAMID_LEVELS}}
+
+
+def encode_tile(plane, fmt="png"):
+    """uint8 2D 슬라이스를 이미지 바이트로 인코딩합니다."""
+    f = io.BytesIO()
+    if fmt == "webp":
+        PIL.Image.fromarray(plane).save(f, format="WEBP", lossless=True)
+    else:
+        PIL.Image.fromarray(plane).save(f, format="PNG")
+    return f.getvalue()
+
+
+def build_tile_pack(volume, axis, fmt="png"):
+    """축의 모든 슬라이스를 인코딩해 (오프셋, 이어 붙인 바이트)로 묶습니다.
+
+    i번 슬라이스는 data[offsets[i]:offsets[i + 1]]입니다.
+    """
+    tiles = [encode_tile(np.asarray(np.take(volume, i, axis=axis)), fmt) for i in range(volume.shape[axis])]
+    offsets = np.zeros(len(tiles) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in tiles], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(tiles), dtype=np.uint8)
+
+
+def save_tile_pack(f, pack):
+    offsets, data = pack
+    np.savez(f, offsets=offsets, data=data)
+
+
+def read_tile_pack(path):
+    with np.load(path) as z:
+        return z["offsets"], z["data"]
+
+
+def tile_params(window, level, axis, fmt):
+    w_level, w_width = window
+    return f"w{w_level:g}-{w_width:g}-l{level}-a{axis}-{fmt}"
+
+
+class SliceTiles:
+    """(이미지 이름, 윈도우, 레벨, 축, 형식)별로 미리 인코딩한 슬라이스 이미지 저장소
+
+    묶음은 스캔 캐시에 저장하고, 최근에 쓴 묶음은 메모리 LRU에 보관하므로
+    같은 환자를 다시 볼 때는 인코딩하지 않고 바이트를 그대로 보냅니다.
+    """
+
+    def __init__(self, pyramids, max_items=32):
+        self.pyramids = pyramids
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def pack(self, image_name, window=BRAIN_WINDOW, level=0, axis=0, fmt="png"):
+        key = (image_name, tuple(window), level, axis, fmt)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        # 같은 묶음은 한 번만 인코딩하고, 동시에 요청한 콜백은 그 결과를 기다림
+        with load_lock:
+            try:
+                with self._lock:
+                    if key in self._items:
+                        self._items.move_to_end(key)
+                        return self._items[key]
+                pack = cached_artifact(
+                    lambda: artifact_path("tiles", image_name, tile_params(window, level, axis, fmt), "npz"),
+                    image_name,
+                    compute=lambda: build_tile_pack(self.pyramids.get(image_name, window, level, axis), axis, fmt),
+                    save=save_tile_pack,
+                    load=read_tile_pack,
+                    label=f"슬라이스 타일 ({fmt}, 레벨 {level or '전체'}, 축 {axis})",
+                )
+                with self._lock:
+                    self._items[key] = pack
+                    while len(self._items) > self.max_items:
+                        self._items.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return pack
+
+    def tile(self, image_name, window=BRAIN_WINDOW, level=0, axis=0, index=0, fmt="png"):
+        """index번 슬라이스의 인코딩된 바이트 (범위를 벗어나면 None)"""
+        offsets, data = self.pack(image_name, window, level, axis, fmt)
+        if not 0 <= index < len(offsets) - 1:
+            return None
+        return data[offsets[index]:offsets[index + 1]].tobytes()
+
+    def data_uri(self, image_name, window=BRAIN_WINDOW, level=0, axis=0, index=0, fmt="png"):
+        """index번 슬라이스의 data URI (범위를 벗어나면 None)"""
+        tile = self.tile(image_name, window, level, axis, index, fmt)
+        if tile is None:
+            return None
+        return f"data:{TILE_FORMATS[fmt]};base64," + base64.b64encode(tile).decode()
+
+    def data_uris(self, image_name, window=BRAIN_WINDOW, level=0, axis=0, fmt="png"):
+        """축의 모든 슬라이스 data URI 목록 (슬라이서 썸네일용)"""
+        offsets, data = self.pack(image_name, window, level, axis, fmt)
+        prefix = f"data:{TILE_FORMATS[fmt]};base64,"
+        return [
+            prefix + base64.b64encode(data[start:end]).decode()
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+
+def tile_etag(image_name, window, level, axis, index, fmt):
+    """스캔 SHA256과 타일 파라미터로 만든 strong ETag (같은 값이면 같은 바이트)"""
+    return f"{source_digest(image_name)[:16]}-{tile_params(window, level, axis, fmt)}-i{index}"
@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from skimage import filters
+
+# 평활화(median) 필터 footprint: 축방향 슬라이스마다 3x3
+MEDIAN_FOOTPRINT = np.ones((1, 3, 3), dtype=bool)
+# 평활화 엔진 버전 (캐시 키에 들어감). 1: float64 filters.median, 2: 입력 dtype을 유지하는 정렬 네트워크
+MEDIAN_ENGINE_VERSION = 2
+
+# 9개 값의 중앙값을 구하는 비교-교환 네트워크 (19회). 결과는 4번 위치에 남습니다.
+_MEDIAN9_NETWORK = [
+    (1, 2), (4, 5), (7, 8), (0, 1), (3, 4), (6, 7), (1, 2), (4, 5), (7, 8),
+    (0, 3), (5, 8), (4, 7), (3, 6), (1, 4), (2, 5), (4, 7), (4, 2), (6, 4), (4, 2),
+]
+
+# 한 작업이 처리하는 축방향 슬라이스 수 (512x512 int16 기준 9개 버퍼가 캐시에 머무는 크기)
+SLICES_PER_TASK = 4
+
+
+def _median3x3(block, out):
+    """(슬라이스, 행, 열) 블록의 각 슬라이스에 3x3 median을 적용해 out에 씁니다.
+
+    가장자리는 filters.median과 같이 'nearest' 방식으로 채웁니다.
+    numpy의 minimum/maximum만 사용하므로 GIL 없이 스레드에서 병렬로 실행됩니다.
+    """
+    padded = np.pad(block, ((0, 0), (1, 1), (1, 1)), mode="edge")
+    h, w = block.shape[1:]
+    s = [padded[:, dy:dy + h, dx:dx + w].copy() for dy in range(3) for dx in range(3)]
+    lo = np.empty_like(s[0])
+    for a, b in _MEDIAN9_NETWORK:
+        np.minimum(s[a], s[b], out=lo)
+        np.maximum(s[a], s[b], out=s[b])
+        s[a], lo = lo, s[a]
+    out[...] = s[4]
+
+
+def median_smooth(volume, footprint=MEDIAN_FOOTPRINT, workers=None):
+    """filters.median(volume, footprint)과 비트 단위로 같은 결과를 반환합니다.
+
+    footprint가 (1, 3, 3)이면 축방향 슬라이스를 묶음으로 나눠 스레드 풀에서 처리하고,
+    입력 dtype(int16 HU)을 그대로 유지합니다. 다른 footprint는 filters.median을 사용합니다.
+    """
+    footprint = np.asarray(footprint, dtype=bool)
+    if (
+        volume.ndim != 3
+        or footprint.shape != (1, 3, 3)
+        or not footprint.all()
+        or volume.dtype.kind not in "iub"
+    ):
+        return filters.median(volume, footprint=footprint)
+
+    out = np.empty(volume.shape, dtype=volume.dtype)
+    bounds = [(i, min(i + SLICES_PER_TASK, volume.shape[0])) for i in range(0, volume.shape[0], SLICES_PER_TASK)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(bounds) == 1:
+        for i, j in bounds:
+            _median3x3(volume[i:j], out[i:j])
+        return out
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(bounds))) as pool:
+        for _ in pool.map(lambda b: _median3x3(volume[b[0]:b[1]], out[b[0]:b[1]]), bounds):
+            pass
+    return out
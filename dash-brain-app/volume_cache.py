@@ -0,0 +1,370 @@
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+from nilearn import image
+from skimage import exposure
+
+from smoothing import MEDIAN_ENGINE_VERSION, MEDIAN_FOOTPRINT, median_smooth
+
+# 데이터셋 경로 설정
+DATASET_DIR = "../dash-brain-ct-data"  # 올바른 상대 경로로 수정
+DEFAULT_IMAGE = "assets/sample_brain_ct.nii"  # 기본 뇌 CT 이미지로 변경
+DEFAULT_IMAGE_NAME = "기본 뇌 CT 샘플 이미지 (NII)"
+
+SHA256SUMS_PATH = os.path.join(DATASET_DIR, "SHA256SUMS.txt")
+
+# 전처리된 볼륨을 저장하는 디스크 캐시 (gunicorn 워커끼리 페이지를 공유)
+CACHE_DIR = os.environ.get("BRAIN_CT_CACHE_DIR", os.path.join(DATASET_DIR, "cache"))
+
+INT16_MIN, INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+
+def image_path(image_name):
+    """드롭다운 값(이미지 이름)을 NIfTI 파일 경로로 변환합니다."""
+    if image_name == DEFAULT_IMAGE_NAME:
+        return DEFAULT_IMAGE
+    return os.path.join(DATASET_DIR, "ct_scans", image_name)
+
+
+def cache_stem(image_name):
+    """캐시 파일 이름에 쓰는 스캔 이름 (예: '049.nii' -> '049')"""
+    base = os.path.basename(image_path(image_name))
+    for ext in (".nii.gz", ".nii"):
+        if base.lower().endswith(ext):
+            return base[: -len(ext)]
+    return base
+
+
+def volume_cache_paths(image_name):
+    """재배열된 볼륨(.npy)과 스페이싱 사이드카(.json) 경로"""
+    stem = os.path.join(CACHE_DIR, "volumes", cache_stem(image_name))
+    return stem + ".npy", stem + ".json"
+
+
+def artifact_path(kind, image_name, params, ext):
+    """스캔에서 파생된 캐시 파일 경로. 스캔의 SHA256과 계산 파라미터가 파일 이름에 들어갑니다."""
+    name = f"{cache_stem(image_name)}.{source_digest(image_name)[:16]}.{params}.{ext}"
+    return os.path.join(CACHE_DIR, kind, name)
+
+
+def smoothed_cache_path(image_name, footprint=MEDIAN_FOOTPRINT, dtype=np.int16):
+    """평활화 볼륨 경로 (footprint 모양과 내용의 해시, 결과 dtype, 엔진 버전이 파라미터)"""
+    footprint = np.asarray(footprint, dtype=bool)
+    fp_key = "x".join(str(n) for n in footprint.shape)
+    fp_key += "-" + hashlib.sha1(np.packbits(footprint).tobytes()).hexdigest()[:8]
+    params = f"{fp_key}-{np.dtype(dtype).name}-e{MEDIAN_ENGINE_VERSION}"
+    return artifact_path("smoothed", image_name, params, "npy")
+
+
+_checksums = {"stamp": None, "digests": {}}
+_file_digests = {}
+
+
+def read_checksums():
+    """SHA256SUMS.txt를 {상대 경로: digest} 딕셔너리로 읽습니다 (파일이 바뀔 때만 다시 읽음)."""
+    try:
+        stamp = _source_stamp(SHA256SUMS_PATH)
+    except OSError:
+        return {}
+    if _checksums["stamp"] != stamp:
+        digests = {}
+        with open(SHA256SUMS_PATH, encoding="utf-8") as f:
+            for line in f:
+                parts = line.strip().split(maxsplit=1)
+                if len(parts) == 2:
+                    digests[parts[1].lstrip("*")] = parts[0].lower()
+        _checksums.update(stamp=stamp, digests=digests)
+    return _checksums["digests"]
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_dataset_modules = {}
+
+
+def _dataset_module(name):
+    """DATASET_DIR에 있는 데이터셋 도구 모듈 (verify_checksums, mask_store)을 한 번만 읽어 반환합니다."""
+    if name not in _dataset_modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(DATASET_DIR, f"{name}.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _dataset_modules[name] = module
+    return _dataset_modules[name]
+
+
+def require_verified_dataset(allow_missing=True):
+    """DATASET_DIR/verify_checksums.py로 SHA256SUMS.txt의 파일을 검증합니다.
+
+    크기와 수정 시각이 바뀐 파일만 다시 해시하므로 매번 전체를 해시하지 않습니다.
+    digest가 다르거나 (allow_missing=False이면) 없는 파일이 있으면 RuntimeError를 냅니다.
+    """
+    verifier = _dataset_module("verify_checksums")
+    try:
+        result = verifier.require_verified_dataset(DATASET_DIR, allow_missing=allow_missing)
+    except verifier.DatasetIntegrityError as e:
+        raise RuntimeError(str(e)) from e
+    print(f"✅ 데이터셋 검증 완료: {result.checked}개 파일 (다시 해시 {result.rehashed}개, 없는 파일 {len(result.missing)}개)")
+    return result
+
+
+def mask_path(image_name):
+    """스캔의 정답 병변 마스크 NIfTI 경로 (기본 샘플은 마스크가 없어 None)"""
+    if image_name == DEFAULT_IMAGE_NAME:
+        return None
+    return os.path.join(DATASET_DIR, "masks", image_name)
+
+
+def load_lesion_mask(image_name):
+    """정답 병변 마스크를 비트 압축 저장소(CACHE_DIR/masks)에서 읽거나 만들어 반환합니다.
+
+    load_image와 같은 (슬라이스, 행, 열) 방향입니다. 마스크 파일이 없으면 None
+    """
+    path = mask_path(image_name)
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        return _dataset_module("mask_store").load_lesion_mask(path, os.path.join(CACHE_DIR, "masks"))
+    except (OSError, ValueError) as e:
+        print(f"정답 마스크 읽기 오류 ({image_name}): {e}")
+        return None
+
+
+def source_digest(image_name):
+    """SHA256SUMS.txt에 적힌 스캔의 digest. 목록에 없는 파일(기본 샘플)은 직접 해시합니다."""
+    digest = read_checksums().get(f"ct_scans/{image_name}")
+    if digest:
+        return digest
+    path = image_path(image_name)
+    key = (path, tuple(_source_stamp(path).values()))
+    if key not in _file_digests:
+        _file_digests[key] = file_sha256(path)
+    return _file_digests[key]
+
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _compact(data):
+    """HU 값이 정수이고 int16 범위면 int16, 아니면 float32로 변환합니다."""
+    if np.issubdtype(data.dtype, np.integer):
+        if data.size == 0 or (data.min() >= INT16_MIN and data.max() <= INT16_MAX):
+            return data.astype(np.int16, copy=False)
+        return data.astype(np.float32)
+    if (
+        np.isfinite(data).all()
+        and data.min() >= INT16_MIN
+        and data.max() <= INT16_MAX
+        and np.array_equal(np.rint(data), data)
+    ):
+        return data.astype(np.int16)
+    return data.astype(np.float32)
+
+
+def read_nifti(path):
+    """NIfTI를 읽어 (슬라이스, 행, 열) 방향으로 재배열한 볼륨과 스페이싱을 반환합니다."""
+    nii = image.load_img(path)
+    mat = nii.affine
+    # 스케일이 없는 정수 데이터는 float64로 넓히지 않고 그대로 사용
+    data = np.asanyarray(nii.dataobj)
+    data = _compact(data)
+    data = np.ascontiguousarray(np.moveaxis(data, -1, 0)[:, ::-1])
+    spacing = abs(mat[2, 2]), abs(mat[1, 1]), abs(mat[0, 0])
+    return data, tuple(float(s) for s in spacing)
+
+
+def _atomic_save(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 스레드/프로세스마다 다른 임시 파일: 같은 결과를 동시에 저장해도 서로의 파일을 덮어쓰지 않음
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def convert_volume(image_name):
+    """NIfTI 한 개를 재배열된 .npy와 스페이싱 사이드카로 변환합니다."""
+    src = image_path(image_name)
+    data, spacing = read_nifti(src)
+    npy_path, meta_path = volume_cache_paths(image_name)
+    meta = {
+        "source": src,
+        "stamp": _source_stamp(src),
+        "shape": list(data.shape),
+        "dtype": str(data.dtype),
+        "spacing": list(spacing),
+    }
+
+    def write_npy(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+
+    def write_meta(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    # 사이드카를 나중에 써서, 사이드카가 있으면 배열도 완성되어 있음을 보장
+    _atomic_save(npy_path, write_npy)
+    _atomic_save(meta_path, write_meta)
+    return data, spacing
+
+
+def _read_cached(image_name):
+    npy_path, meta_path = volume_cache_paths(image_name)
+    if not (os.path.exists(npy_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("stamp") != _source_stamp(image_path(image_name)):
+        return None  # 원본 NIfTI가 바뀌었으면 다시 변환
+    img = np.load(npy_path, mmap_mode="r")
+    return img, tuple(meta["spacing"])
+
+
+def load_cached_volume(image_name):
+    """캐시에 있으면 메모리 매핑으로 읽고, 없으면 변환 후 캐시에 저장합니다."""
+    try:
+        cached = _read_cached(image_name)
+        if cached is not None:
+            return cached
+    except (OSError, ValueError, KeyError) as e:
+        print(f"볼륨 캐시 읽기 오류 ({image_name}): {e}")
+    try:
+        convert_volume(image_name)
+        cached = _read_cached(image_name)
+        if cached is not None:
+            return cached
+    except OSError as e:
+        # 캐시 디렉토리에 쓸 수 없으면 메모리에서만 사용
+        print(f"볼륨 캐시 쓰기 오류 ({image_name}): {e}")
+    return read_nifti(image_path(image_name))
+
+
+def _remove_stale(path, image_name, exclusive=False):
+    """digest가 바뀌어 더 이상 쓰이지 않는 같은 스캔의 이전 결과를 지웁니다.
+
+    exclusive이면 스캔당 결과가 하나뿐인 종류로 보고, 파라미터(footprint, dtype, 엔진 버전 등)가
+    path와 다른 같은 스캔의 결과도 지웁니다.
+    """
+    digest = os.path.basename(path).split(".")[1]
+    for stale in glob.glob(os.path.join(os.path.dirname(path), cache_stem(image_name) + ".*")):
+        parts = os.path.basename(stale).split(".")
+        if len(parts) <= 2 or stale.endswith(".tmp"):
+            continue
+        if parts[1] != digest or (exclusive and os.path.basename(stale) != os.path.basename(path)):
+            os.remove(stale)
+
+
+def cached_artifact(path_fn, image_name, compute, save, load, label, exclusive=False):
+    """스캔당 한 번만 계산하여 디스크에 저장하고, 이후에는 저장된 결과를 읽습니다.
+
+    path_fn은 캐시 경로를 만드는 함수, save(f, value)는 열린 파일에 쓰고
+    load(path)는 저장된 결과를 읽습니다. 캐시를 쓸 수 없으면 계산 결과만 반환합니다.
+    exclusive이면 저장할 때 파라미터가 다른 같은 스캔의 이전 결과를 지웁니다 (_remove_stale).
+    """
+    try:
+        path = path_fn()
+        if os.path.exists(path):
+            return load(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"{label} 캐시 읽기 오류 ({image_name}): {e}")
+        path = None
+
+    value = compute()
+    if path is None:
+        return value
+    try:
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                save(f, value)
+
+        _atomic_save(path, write)
+        _remove_stale(path, image_name, exclusive)
+        return load(path)
+    except OSError as e:
+        print(f"{label} 캐시 쓰기 오류 ({image_name}): {e}")
+        return value
+
+
+def load_smoothed(image_name, img, footprint=MEDIAN_FOOTPRINT):
+    """평활화 볼륨을 스캔당 한 번만 계산하고, 이후에는 메모리 매핑으로 재사용합니다."""
+    return cached_artifact(
+        # median_smooth는 입력 dtype을 유지하므로 결과 dtype은 img.dtype
+        lambda: smoothed_cache_path(image_name, footprint, img.dtype),
+        image_name,
+        compute=lambda: median_smooth(img, footprint=footprint),
+        save=np.save,
+        load=lambda path: np.load(path, mmap_mode="r"),
+        label="평활화",
+        # footprint, dtype, 엔진 버전이 바뀌면 볼륨 크기의 이전 결과는 다시 쓰이지 않음
+        exclusive=True,
+    )
+
+
+def load_histogram(image_name, med_img, nbins=256):
+    """평활화 볼륨 전체의 HU 히스토그램 (빈도, 구간 중심)"""
+    def compute():
+        # 정수 HU 볼륨도 nbins개 구간으로 표시
+        return exposure.histogram(np.asarray(med_img, dtype=np.float32), nbins=nbins)
+
+    def save(f, hist):
+        np.savez(f, counts=hist[0], centers=hist[1])
+
+    def load(path):
+        with np.load(path) as data:
+            return data["counts"], data["centers"]
+
+    return cached_artifact(
+        lambda: artifact_path("histogram", image_name, f"b{nbins}", "npz"),
+        image_name, compute, save, load, label="히스토그램",
+    )
+
+
+def clear_scan_cache(image_name):
+    """한 스캔의 모든 캐시 파일을 지웁니다 (precompute --force 용)."""
+    stem = cache_stem(image_name)
+    for path in glob.glob(os.path.join(CACHE_DIR, "*", stem + ".*")):
+        if os.path.basename(path).split(".")[0] == stem:
+            os.remove(path)
+
+
+# 이미지 로드 함수
+def load_image(image_name):
+    try:
+        if image_name != DEFAULT_IMAGE_NAME:
+            print(f"🔄 이미지 로드 중: {image_path(image_name)}")
+        img, spacing = load_cached_volume(image_name)
+        print(f"이미지 크기: {img.shape}, 스페이싱: {spacing}")
+        return img, spacing
+    except Exception as e:
+        print(f"이미지 로드 오류: {e}")
+        # 기본 이미지로 폴백
+        return load_cached_volume(DEFAULT_IMAGE_NAME)
+
+
+if __name__ == "__main__":
+    # 사용법: python volume_cache.py [049.nii ...]  (인자가 없으면 ct_scans 전체 변환)
+    names = sys.argv[1:]
+    if not names:
+        ct_scans_dir = os.path.join(DATASET_DIR, "ct_scans")
+        names = sorted(f for f in os.listdir(ct_scans_dir) if f.lower().endswith((".nii", ".nii.gz")))
+    for name in names:
+        data, spacing = convert_volume(name)
+        print(f"✅ {name}: {data.shape} {data.dtype}, 스페이싱 {spacing}")
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class Volume:
+    """하나의 CT 스캔에 대해 콜백들이 공유하는 읽기 전용 데이터"""
+    name: str
+    img: np.ndarray
+    med_img: np.ndarray
+    spacing: Tuple[float, float, float]
+    # 관심 영역 히스토그램 인덱스 (roi_histogram.HistogramIndex, 정수 볼륨이 아니면 None)
+    roi_histograms: Optional[Any] = None
+    # 정답 병변 마스크 (mask_store.LesionMask, 마스크가 없으면 None)
+    lesion_mask: Optional[Any] = None
+
+    @property
+    def nbytes(self) -> int:
+        extra = sum(part.nbytes for part in (self.roi_histograms, self.lesion_mask) if part is not None)
+        return self.img.nbytes + self.med_img.nbytes + extra
+
+
+class VolumeStore:
+    """이미지 이름을 키로 로드된 볼륨을 보관하는 바이트 상한 LRU 저장소
+
+    콜백은 전역 변수 대신 세션의 dcc.Store에 담긴 이미지 이름으로 볼륨을 조회합니다.
+    같은 이미지를 동시에 요청해도 로드는 한 번만 수행됩니다.
+    """
+
+    def __init__(self, loader: Callable[[str], Volume], max_bytes: int = 1 << 30):
+        self._loader = loader
+        self.max_bytes = max_bytes
+        self._volumes: "OrderedDict[str, Volume]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._volumes
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._volumes)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(v.nbytes for v in self._volumes.values())
+
+    def peek(self, name: str) -> Optional[Volume]:
+        """로드하지 않고 캐시에 있는 볼륨만 반환합니다."""
+        with self._lock:
+            return self._volumes.get(name)
+
+    def get(self, name: str) -> Volume:
+        """볼륨을 반환하고, 없으면 로드하여 캐시에 넣습니다."""
+        with self._lock:
+            volume = self._volumes.get(name)
+            if volume is not None:
+                self._volumes.move_to_end(name)
+                return volume
+            load_lock = self._loading.setdefault(name, threading.Lock())
+
+        # 이미지별 잠금: 다른 이미지의 로드는 막지 않고 같은 이미지의 중복 로드만 막음
+        with load_lock:
+            with self._lock:
+                volume = self._volumes.get(name)
+                if volume is not None:
+                    self._volumes.move_to_end(name)
+                    return volume
+            try:
+                volume = self._loader(name)
+                with self._lock:
+                    self._volumes[name] = volume
+                    self._volumes.move_to_end(name)
+                    self._evict(keep=name)
+            finally:
+                # 로드가 실패해도 이미지별 잠금을 남기지 않음
+                with self._lock:
+                    self._loading.pop(name, None)
+        return volume
+
+    def _evict(self, keep: str) -> None:
+        total = sum(v.nbytes for v in self._volumes.values())
+        while total > self.max_bytes and len(self._volumes) > 1:
+            oldest = next(iter(self._volumes))
+            if oldest == keep:
+                break
+            evicted = self._volumes.pop(oldest)
+            total -= evicted.nbytes
+            print(f"🗑️ 볼륨 캐시에서 제거: {oldest} ({evicted.nbytes / 2**20:.1f} MB)")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._volumes.clear()
@@ -0,0 +1,58 @@
+from functools import lru_cache
+
+import numpy as np
+
+# (window level, window width). 뇌 윈도우는 dash-brain-ct-data/split_raw_data.py의 window_specs,
+# 뼈 윈도우는 Read_me.txt에 적힌 어노테이션 때 쓴 값과 같음
+BRAIN_WINDOW = (40, 120)
+SUBDURAL_WINDOW = (75, 215)
+BONE_WINDOW = (700, 3200)
+# 이름으로 고를 수 있는 윈도우 (UI, 타일 URL 등)
+WINDOW_PRESETS = {"brain": BRAIN_WINDOW, "subdural": SUBDURAL_WINDOW, "bone": BONE_WINDOW}
+
+# 룩업 테이블이 다루는 정수 HU 범위 (12비트 CT). 범위 밖 값은 양 끝 값으로 잘라도
+# 윈도우가 이 범위 안에 있으면 결과가 같음
+LUT_MIN = -1024
+LUT_SIZE = 4096
+
+
+def window_bounds(w_level, w_width):
+    """윈도우 (level, width)를 표시 HU 범위 (w_min, w_max)로 변환합니다."""
+    return w_level - w_width / 2, w_level + w_width / 2
+
+
+def window_ct(ct_scan, w_level=BRAIN_WINDOW[0], w_width=BRAIN_WINDOW[1]):
+    """split_raw_data.window_ct와 같은 윈도우 변환을 볼륨 전체에 한 번에 적용한 uint8 배열
+
+    원본처럼 슬라이스마다 입력을 덮어쓰지 않고 새 배열을 반환합니다.
+    """
+    w_min, w_max = window_bounds(w_level, w_width)
+    scaled = (np.asarray(ct_scan, dtype=np.float32) - np.float32(w_min)) * np.float32(255 / (w_max - w_min))
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+@lru_cache(maxsize=16)
+def window_lut(w_level, w_width):
+    """정수 HU LUT_MIN..LUT_MIN + LUT_SIZE - 1의 window_ct 결과 (길이 LUT_SIZE, 읽기 전용)"""
+    lut = window_ct(np.arange(LUT_MIN, LUT_MIN + LUT_SIZE), w_level, w_width)
+    lut.flags.writeable = False
+    return lut
+
+
+def apply_window(ct_scan, w_level=BRAIN_WINDOW[0], w_width=BRAIN_WINDOW[1]):
+    """window_ct와 같은 uint8 볼륨. int16 HU 볼륨은 복셀마다 계산하지 않고 룩업 테이블로 변환합니다.
+
+    슬라이스 단위로 변환하므로 볼륨 크기의 float32 임시 배열을 만들지 않습니다.
+    """
+    w_min, w_max = window_bounds(w_level, w_width)
+    if ct_scan.dtype != np.int16 or w_min < LUT_MIN or w_max > LUT_MIN + LUT_SIZE - 1:
+        return window_ct(ct_scan, w_level, w_width)
+    lut = window_lut(w_level, w_width)
+    out = np.empty(ct_scan.shape, dtype=np.uint8)
+    for z in range(ct_scan.shape[0]):
+        # int16 안에서 잘라 옮겨도 인덱스(0..LUT_SIZE - 1)가 넘치지 않음
+        index = np.clip(ct_scan[z], LUT_MIN, LUT_MIN + LUT_SIZE - 1)
+        index -= LUT_MIN
+        np.take(lut, index, out=out[z])
+    return out
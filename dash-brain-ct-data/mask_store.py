@@ -0,0 +1,169 @@
+# Compact store for the ground-truth hemorrhage masks (masks/*.nii).
+#
+# Each mask is reoriented the same way the viewer reorients the CT (dash-brain-app/volume_cache.read_nifti:
+# slices first, rows flipped) and saved as one bit-packed row per non-empty slice, together with per-slice
+# bounding boxes, to <store dir>/<name>.npz. Empty slices take no space, so a mask is usually a few KB.
+# Slice z of the store is slice z of the NIfTI (masks[:, :, z]), so the export can skip empty slices
+# by looking at LesionMask.nonempty without decoding anything.
+#
+# Usage: python mask_store.py [--dataset-dir DIR] [--store-dir DIR] [--workers N]
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+
+STORE_DIR_NAME = os.path.join('cache', 'masks')
+
+
+def reorient(data):
+    """(x, y, slice) NIfTI array -> (slice, row, col) as the viewer shows it."""
+    return np.moveaxis(data, -1, 0)[:, ::-1]
+
+
+class LesionMask:
+    """Bit-packed ground-truth mask with per-slice random access and lesion bounding boxes.
+
+    packed[k] is the np.packbits of the k-th non-empty slice, slice_rows[z] is k for slice z (-1 when empty)
+    and boxes[z] is the half-open (row0, row1, col0, col1) of the lesion pixels in slice z (-1 when empty).
+    """
+
+    def __init__(self, shape, packed, slice_rows, boxes):
+        self.shape = tuple(int(n) for n in shape)
+        self.packed = packed
+        self.slice_rows = slice_rows
+        self.boxes = boxes
+
+    @classmethod
+    def from_slices(cls, slices, shape):
+        """Build from an iterable of bool (row, col) slices in viewer orientation."""
+        packed = []
+        slice_rows = np.full(shape[0], -1, dtype=np.int32)
+        boxes = np.full((shape[0], 4), -1, dtype=np.int32)
+        for z, mask in enumerate(slices):
+            rows = np.flatnonzero(mask.any(axis=1))
+            if len(rows) == 0:
+                continue
+            cols = np.flatnonzero(mask.any(axis=0))
+            slice_rows[z] = len(packed)
+            boxes[z] = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            packed.append(np.packbits(mask, axis=None))
+        nbytes = -(-shape[1] * shape[2] // 8)
+        packed = np.stack(packed) if packed else np.zeros((0, nbytes), dtype=np.uint8)
+        return cls(shape, packed, slice_rows, boxes)
+
+    @property
+    def nonempty(self):
+        """bool per slice: does the slice contain lesion pixels"""
+        return self.slice_rows >= 0
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes + self.slice_rows.nbytes + self.boxes.nbytes
+
+    def slice(self, z):
+        """bool (row, col) mask of slice z (only this slice is decoded)"""
+        k = self.slice_rows[z]
+        if k < 0:
+            return np.zeros(self.shape[1:], dtype=bool)
+        bits = np.unpackbits(self.packed[k], count=self.shape[1] * self.shape[2])
+        return bits.reshape(self.shape[1:]).view(bool)
+
+    def slice_box(self, z):
+        """(row0, row1, col0, col1) of slice z, or None when the slice is empty"""
+        return None if self.slice_rows[z] < 0 else tuple(int(v) for v in self.boxes[z])
+
+    @property
+    def bbox(self):
+        """half-open (z0, z1, row0, row1, col0, col1) of all lesion voxels, or None without lesions"""
+        zs = np.flatnonzero(self.nonempty)
+        if len(zs) == 0:
+            return None
+        boxes = self.boxes[zs]
+        return (int(zs[0]), int(zs[-1]) + 1, int(boxes[:, 0].min()), int(boxes[:, 1].max()),
+                int(boxes[:, 2].min()), int(boxes[:, 3].max()))
+
+    def save(self, f, stamp=None):
+        np.savez(f, shape=np.asarray(self.shape), packed=self.packed, slice_rows=self.slice_rows,
+                 boxes=self.boxes, stamp=np.asarray(stamp if stamp is not None else [-1, -1], dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        """(LesionMask, stamp of the source NIfTI when it was stored)"""
+        with np.load(path) as z:
+            return cls(z['shape'], z['packed'], z['slice_rows'], z['boxes']), tuple(int(v) for v in z['stamp'])
+
+
+def read_mask(nifti_path):
+    """Read a mask NIfTI one slice at a time (through nibabel's array proxy) into a LesionMask."""
+    proxy = nib.load(str(nifti_path)).dataobj
+    x, y, depth = proxy.shape[:3]
+    # reorient(data)[z] == data[::-1, :, z]
+    slices = (np.asarray(proxy[::-1, :, z]) > 0 for z in range(depth))
+    return LesionMask.from_slices(slices, (depth, x, y))
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def load_lesion_mask(nifti_path, store_dir):
+    """The stored LesionMask of a mask NIfTI, (re)building it when missing or when the NIfTI changed.
+
+    Returns None when the NIfTI does not exist. If the store cannot be written the mask is only returned.
+    """
+    nifti_path = Path(nifti_path)
+    if not nifti_path.exists():
+        return None
+    stamp = _stamp(nifti_path)
+    name = nifti_path.name
+    for ext in ('.nii.gz', '.nii'):
+        if name.lower().endswith(ext):
+            name = name[:-len(ext)]
+    store_path = Path(store_dir, name + '.npz')
+    try:
+        mask, stored_stamp = LesionMask.load(store_path)
+        if stored_stamp == stamp:
+            return mask
+    except (OSError, ValueError, KeyError):
+        pass
+
+    mask = read_mask(nifti_path)
+    tmp = '{}.{}.tmp'.format(store_path, os.getpid())
+    try:
+        store_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, 'wb') as f:
+            mask.save(f, stamp)
+        os.replace(tmp, store_path)
+    except OSError as e:
+        print('Warning: could not write {}: {}'.format(store_path, e))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert masks/*.nii into the compact lesion mask store.')
+    parser.add_argument('--dataset-dir', default=str(Path(__file__).resolve().parent), help='folder with masks/')
+    parser.add_argument('--store-dir', default=None, help='output folder (default: <dataset-dir>/cache/masks)')
+    parser.add_argument('--workers', type=int, default=None, help='number of threads')
+    args = parser.parse_args()
+
+    dataset_dir = Path(args.dataset_dir)
+    store_dir = Path(args.store_dir) if args.store_dir else dataset_dir / STORE_DIR_NAME
+    paths = sorted(dataset_dir.glob('masks/*.nii')) + sorted(dataset_dir.glob('masks/*.nii.gz'))
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for path, mask in zip(paths, executor.map(lambda p: load_lesion_mask(p, store_dir), paths)):
+            print('{}: {} of {} slices with lesions, bbox {}, {} bytes'.format(
+                path.name, int(mask.nonempty.sum()), mask.shape[0], mask.bbox, mask.nbytes))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,77 +1,258 @@
 # This code loads the CT slices (grayscale images) of the brain-window for each subject in ct_scans folder then saves them to
-# one folder (data\image).
-# Their segmentation from the masks folder is saved to another folder (data\label).
+# one folder (data/image).
+# Their segmentation from the masks folder is saved to another folder (data/label).
+#
+# Subjects are exported in parallel (one subject per worker process). Output files keep the numbering of the
+# original sequential export: slice i of the k-th subject is saved as <number of label rows of subjects before k> + i.
+#
+# With --format shards (or both) the slices are also written as fixed-size shards in data/shards:
+# images-00000.npy and masks-00000.npy hold up to --shard-size uint8 slices each (N x 512 x 512), and
+# index.csv maps every (PatientNumber, SliceNumber) with its hemorrhage flags to its (shard, offset).
+# Training loaders can memory-map a whole shard (np.load(path, mmap_mode='r')) and read it sequentially.
+#
+# Slices are streamed from the NIfTI files one at a time (see iter_subject_slices / iter_dataset), which other
+# code can also import to consume (image, mask, labels) tuples directly without writing files.
+#
+# With --lesions-only, slices without lesion pixels are skipped using the compact mask store (mask_store.py),
+# without decoding the mask NIfTI slices; PNG files keep their original numbers (with gaps).
+#
+# Usage: python split_raw_data.py [--workers N] [--dataset-dir DIR] [--out DIR] [--format png|shards|both] [--verify]
+#                                 [--lesions-only]
 
+import argparse
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from time import time
+
+import nibabel as nib
 import numpy as np
 import pandas as pd
-from scipy.misc import imread, imresize, imsave
-import nibabel as nib
-import matplotlib.pyplot as plt
+from PIL import Image
+
+from mask_store import STORE_DIR_NAME, load_lesion_mask
+from verify_checksums import DatasetIntegrityError, require_verified_dataset
+
+numSubj = 82
+firstSubj = 49
+new_size = (512, 512)
+window_specs = [40, 120]  # Brain window
+missing_subjects = range(59, 66)  # no raw data were available for these subjects
+png_compress_level = 1  # fast zlib level; the images are small and decode the same at any level
+shard_size = 1024  # slices per shard (256 MB of images + 256 MB of masks at 512 x 512)
+
 
-def window_ct (ct_scan, w_level=40, w_width=120):
+def window_ct(ct_scan, w_level=40, w_width=120):
+    """Window the whole volume at once: clip-and-scale HU to [0, 255] and return uint8."""
     w_min = w_level - w_width / 2
     w_max = w_level + w_width / 2
-    num_slices=ct_scan.shape[2]
-    for s in range(num_slices):
-        slice_s = ct_scan[:,:,s]
-        slice_s = (slice_s - w_min)*(255/(w_max-w_min)) #or slice_s = (slice_s - (w_level-(w_width/2)))*(255/(w_width))
-        slice_s[slice_s < 0]=0
-        slice_s[slice_s > 255] = 255
-        #slice_s=np.rot90(slice_s)
-        ct_scan[:,:,s] = slice_s
+    scaled = (np.asarray(ct_scan, dtype=np.float32) - np.float32(w_min)) * np.float32(255 / (w_max - w_min))
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
 
-    return ct_scan
 
-numSubj = 82
-new_size = (512, 512)
-window_specs=[40,120] #Brain window
-currentDir = Path(os.getcwd())
-datasetDir = str(Path(currentDir))
-
-# Reading labels
-hemorrhage_diagnosis_df = pd.read_csv(
-    Path(currentDir, 'hemorrhage_diagnosis_raw_ct.csv'))
-hemorrhage_diagnosis_array = hemorrhage_diagnosis_df._get_values
-
-# reading images
-train_path = Path('data')
-image_path = train_path / 'image'
-label_path = train_path / 'label'
-if not train_path.exists():
-    train_path.mkdir()
-    image_path.mkdir()
-    label_path.mkdir()
-
-counterI = 0
-for sNo in range(0+49, numSubj+49):
-    if sNo>58 and sNo<66: #no raw data were available for these subjects
-        next
-    else:
-        #Loading the CT scan
-        ct_dir_subj = Path(datasetDir,'ct_scans', "{0:0=3d}.nii".format(sNo))
-        ct_scan_nifti = nib.load(str(ct_dir_subj))
-        ct_scan = ct_scan_nifti.get_data()
-        ct_scan = window_ct(ct_scan, window_specs[0], window_specs[1])
-
-        #Loading the masks
-        masks_dir_subj = Path(datasetDir,'masks', "{0:0=3d}.nii".format(sNo))
-        masks_nifti = nib.load(str(masks_dir_subj))
-        masks = masks_nifti.get_data()
-        idx = hemorrhage_diagnosis_array[:, 0] == sNo
-        sliceNos = hemorrhage_diagnosis_array[idx, 1]
-        NoHemorrhage = hemorrhage_diagnosis_array[idx, 7]
-        if sliceNos.size!=ct_scan.shape[2]:
-            print('Warning: the number of annotated slices does not equal the number of slices in NIFTI file!')
-
-        for sliceI in range(0, sliceNos.size):
-            # Saving the a given CT slice
-            x = imresize(ct_scan[:,:,sliceI], new_size)
-            imsave(image_path / (str(counterI) + '.png'), x)
-
-            # Saving the segmentation for a given slice
-            segment_path = Path(masks_dir_subj,str(sliceNos[sliceI]) + '_HGE_Seg.jpg')
-            x = imresize(masks[:,:,sliceI], new_size)
-            imsave(label_path / (str(counterI) + '.png'), x)
-            counterI = counterI+1
\ No newline at end of file
+def read_labels(csv_path):
+    """Read the hemorrhage diagnosis table once and group it by patient: {PatientNumber: rows sorted by slice}."""
+    df = pd.read_csv(csv_path, encoding='utf-8-sig')
+    return {int(patient): rows.sort_values('SliceNumber').reset_index(drop=True)
+            for patient, rows in df.groupby('PatientNumber')}
+
+
+def ct_path(dataset_dir, sNo):
+    return Path(dataset_dir, 'ct_scans', '{0:0=3d}.nii'.format(sNo))
+
+
+def mask_path(dataset_dir, sNo):
+    return Path(dataset_dir, 'masks', '{0:0=3d}.nii'.format(sNo))
+
+
+def subjects(dataset_dir):
+    """Subject numbers with raw data, in export order."""
+    return [sNo for sNo in range(firstSubj, numSubj + firstSubj)
+            if sNo not in missing_subjects and ct_path(dataset_dir, sNo).exists()]
+
+
+def resize_slice(slice_u8, resample):
+    return np.asarray(Image.fromarray(slice_u8).resize(new_size[::-1], resample))
+
+
+def save_png(array, path):
+    Image.fromarray(array).save(path, compress_level=png_compress_level)
+
+
+def shard_paths(shard_dir, shard):
+    return shard_dir / 'images-{0:0=5d}.npy'.format(shard), shard_dir / 'masks-{0:0=5d}.npy'.format(shard)
+
+
+def create_shards(shard_dir, total, size):
+    """Pre-allocate the shard files so that workers can fill their slices in parallel."""
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    for shard in range(-(-total // size)):
+        rows = min(size, total - shard * size)
+        for path in shard_paths(shard_dir, shard):
+            np.lib.format.open_memmap(str(path), mode='w+', dtype=np.uint8, shape=(rows,) + new_size).flush()
+
+
+class ShardWriter:
+    """Writes one subject's slices to consecutive positions of the pre-allocated shards."""
+
+    def __init__(self, shard_dir, size, first_position):
+        self.shard_dir = shard_dir
+        self.size = size
+        self.first_position = first_position
+        self._open = {}
+
+    def write(self, k, image, mask):
+        """Write the subject's k-th exported slice."""
+        shard, offset = divmod(self.first_position + k, self.size)
+        if shard not in self._open:
+            self._open[shard] = [np.load(str(path), mmap_mode='r+') for path in shard_paths(self.shard_dir, shard)]
+        images, masks = self._open[shard]
+        images[offset] = image
+        masks[offset] = mask
+
+    def close(self):
+        for arrays in self._open.values():
+            for array in arrays:
+                array.flush()
+        self._open.clear()
+
+
+def write_shard_index(shard_dir, jobs, size):
+    """index.csv: one row per exported slice with its diagnosis flags and (shard, offset)."""
+    rows = []
+    for sNo, first_index, subj_labels, position, slice_ids in jobs:
+        subj_rows = subj_labels.iloc[slice_ids].copy()
+        positions = np.arange(position, position + len(slice_ids))
+        subj_rows['shard'] = positions // size
+        subj_rows['offset'] = positions % size
+        rows.append(subj_rows)
+    index = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+    index.to_csv(shard_dir / 'index.csv', index=False)
+    return index
+
+
+def iter_subject_slices(dataset_dir, sNo, labels, slice_ids=None):
+    """Yield (image, mask, labels) for the annotated slices of one subject (or only slice_ids), one slice at a time.
+
+    Slices are read lazily through nibabel's array proxy (memory-mapped for uncompressed .nii), so only the
+    current slice is ever in memory. image is the brain-windowed CT slice and mask the 0/255 label, both
+    uint8 at new_size; labels is the slice's row of the diagnosis table as a dict.
+    """
+    ct_proxy = nib.load(str(ct_path(dataset_dir, sNo))).dataobj
+    mask_proxy = nib.load(str(mask_path(dataset_dir, sNo))).dataobj
+    if slice_ids is None:
+        slice_ids = range(min(len(labels), ct_proxy.shape[2]))
+    for sliceI in slice_ids:
+        image = window_ct(ct_proxy[:, :, sliceI], window_specs[0], window_specs[1])
+        # masks are 0/1 labels: save them as 0/255 and resize with nearest neighbour so they stay binary
+        mask = np.where(np.asarray(mask_proxy[:, :, sliceI]) > 0, np.uint8(255), np.uint8(0))
+        yield (resize_slice(image, Image.BILINEAR), resize_slice(mask, Image.NEAREST),
+               labels.iloc[sliceI].to_dict())
+
+
+def iter_dataset(dataset_dir, labels=None):
+    """Yield (image, mask, labels) for every annotated slice of every subject, in export order."""
+    if labels is None:
+        labels = read_labels(Path(dataset_dir, 'hemorrhage_diagnosis_raw_ct.csv'))
+    for sNo in subjects(dataset_dir):
+        if sNo in labels:
+            yield from iter_subject_slices(dataset_dir, sNo, labels[sNo])
+
+
+def export_subject(sNo, dataset_dir, first_index, labels, slice_ids, png_dirs=None, shards=None):
+    """Save the given annotated slices of one subject. Returns (sNo, number of saved slices).
+
+    png_dirs is (image_path, label_path) for the PNG dump, shards is (shard_dir, shard_size, first_position).
+    """
+    writer = ShardWriter(*shards) if shards else None
+    slices = iter_subject_slices(dataset_dir, sNo, labels, slice_ids)
+    for k, (sliceI, (image, mask, _)) in enumerate(zip(slice_ids, slices)):
+        if png_dirs:
+            name = str(first_index + sliceI) + '.png'
+            save_png(image, png_dirs[0] / name)
+            save_png(mask, png_dirs[1] / name)
+        if writer:
+            writer.write(k, image, mask)
+    if writer:
+        writer.close()
+    return sNo, len(slice_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export brain-windowed CT slices and their masks as PNG files and/or shards.')
+    parser.add_argument('--dataset-dir', default=str(Path(__file__).resolve().parent),
+                        help='folder with ct_scans/, masks/ and hemorrhage_diagnosis_raw_ct.csv')
+    parser.add_argument('--out', default=None, help='output folder (default: <dataset-dir>/data)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--format', choices=('png', 'shards', 'both'), default='png',
+                        help='PNG files per slice (data/image, data/label), sharded arrays (data/shards) or both')
+    parser.add_argument('--shard-size', type=int, default=shard_size, help='slices per shard')
+    parser.add_argument('--lesions-only', action='store_true', help='export only slices with lesion pixels')
+    parser.add_argument('--verify', action='store_true',
+                        help='verify the exported subjects against SHA256SUMS.txt first (only changed files are rehashed)')
+    args = parser.parse_args()
+
+    datasetDir = Path(args.dataset_dir)
+    if args.verify:
+        names = ['{0:0=3d}.nii'.format(sNo) for sNo in subjects(datasetDir)]
+        try:
+            require_verified_dataset(datasetDir, files=['ct_scans/' + n for n in names] + ['masks/' + n for n in names]
+                                     + ['hemorrhage_diagnosis_raw_ct.csv'])
+        except DatasetIntegrityError as e:
+            print('Error: ' + str(e))
+            return 1
+    train_path = Path(args.out) if args.out else datasetDir / 'data'
+    png_dirs = None
+    if args.format in ('png', 'both'):
+        png_dirs = (train_path / 'image', train_path / 'label')
+        for path in png_dirs:
+            path.mkdir(parents=True, exist_ok=True)
+
+    # Reading labels (grouped once by patient)
+    labels = read_labels(Path(datasetDir, 'hemorrhage_diagnosis_raw_ct.csv'))
+
+    # The first PNG index of each subject follows the sequential numbering of the original export,
+    # the shard position counts only the slices that are actually exported
+    jobs = []
+    counterI = 0
+    position = 0
+    for sNo in subjects(datasetDir):
+        subj_labels = labels.get(sNo)
+        if subj_labels is None:
+            print('Warning: no diagnosis rows for subject {}, skipping'.format(sNo))
+            continue
+        num_slices = nib.load(str(ct_path(datasetDir, sNo))).shape[2]
+        if len(subj_labels) != num_slices:
+            print('Warning: the number of annotated slices does not equal the number of slices in NIFTI file! (subject {})'.format(sNo))
+        slice_ids = np.arange(min(len(subj_labels), num_slices))
+        if args.lesions_only:
+            lesion_mask = load_lesion_mask(mask_path(datasetDir, sNo), datasetDir / STORE_DIR_NAME)
+            slice_ids = slice_ids[lesion_mask.nonempty[slice_ids]]
+        jobs.append((sNo, counterI, subj_labels, position, slice_ids))
+        counterI += len(subj_labels)
+        position += len(slice_ids)
+
+    shard_dir = None
+    if args.format in ('shards', 'both'):
+        shard_dir = train_path / 'shards'
+        create_shards(shard_dir, position, args.shard_size)
+        write_shard_index(shard_dir, jobs, args.shard_size)
+
+    t_start = time()
+    saved = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [executor.submit(export_subject, sNo, datasetDir, first_index, subj_labels, slice_ids, png_dirs,
+                                   (shard_dir, args.shard_size, subj_position) if shard_dir else None)
+                   for sNo, first_index, subj_labels, subj_position, slice_ids in jobs]
+        for future in futures:
+            sNo, num_slices = future.result()
+            saved += num_slices
+            print('subject {0:0=3d}: {1} slices'.format(sNo, num_slices))
+    print('Saved {} image/label pairs from {} subjects to {} in {:.1f}s'.format(saved, len(jobs), train_path, time() - t_start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# Verifies the dataset files against SHA256SUMS.txt.
+#
+# Files are hashed in parallel threads (hashlib releases the GIL while hashing large buffers) from
+# memory-mapped reads. The (size, mtime, digest) of every hashed file is kept in a small state file
+# (.sha256_state.json next to SHA256SUMS.txt), so a rerun only rehashes files that changed since the last run.
+#
+# Usage: python verify_checksums.py [--workers N] [--full] [--require-all] [--dataset-dir DIR]
+#
+# Library use (e.g. at startup of the app or of an export script):
+#     from verify_checksums import require_verified_dataset
+#     require_verified_dataset(dataset_dir)  # raises DatasetIntegrityError on a mismatch
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import time
+
+SUMS_NAME = 'SHA256SUMS.txt'
+STATE_NAME = '.sha256_state.json'
+chunk_size = 1 << 24  # bytes per hashlib update
+
+Verification = namedtuple('Verification', ['checked', 'rehashed', 'missing', 'mismatched'])
+
+
+class DatasetIntegrityError(Exception):
+    pass
+
+
+def read_sums(sums_path):
+    """SHA256SUMS.txt as {relative path: lowercase hex digest}."""
+    digests = {}
+    with open(sums_path, encoding='utf-8') as f:
+        for line in f:
+            parts = line.strip().split(maxsplit=1)
+            if len(parts) == 2:
+                digests[parts[1].lstrip('*')] = parts[0].lower()
+    return digests
+
+
+def file_sha256(path):
+    """SHA256 of a file read through a memory map."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                with memoryview(m) as view:
+                    for start in range(0, size, chunk_size):
+                        h.update(view[start:start + chunk_size])
+    return h.hexdigest()
+
+
+def read_state(state_path):
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(state_path, state):
+    tmp = '{}.{}.tmp'.format(state_path, os.getpid())
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=0, sort_keys=True)
+        os.replace(tmp, state_path)
+    except OSError as e:
+        print('Warning: could not write {}: {}'.format(state_path, e))
+
+
+def verify_dataset(dataset_dir, workers=None, full=False, files=None):
+    """Check the files listed in SHA256SUMS.txt and return a Verification.
+
+    Files whose size and mtime match the state file reuse the recorded digest; the others are rehashed
+    (all of them with full=True). files restricts the check to some relative paths.
+    """
+    dataset_dir = Path(dataset_dir)
+    expected = read_sums(dataset_dir / SUMS_NAME)
+    if files is not None:
+        expected = {rel: expected[rel] for rel in files if rel in expected}
+    state_path = dataset_dir / STATE_NAME
+    state = {} if full else read_state(state_path)
+
+    missing = []
+    stamps = {}
+    to_hash = []
+    for rel in sorted(expected):
+        try:
+            st = os.stat(dataset_dir / rel)
+        except OSError:
+            missing.append(rel)
+            continue
+        stamps[rel] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        known = state.get(rel)
+        if not (known and known.get('size') == st.st_size and known.get('mtime_ns') == st.st_mtime_ns):
+            to_hash.append(rel)
+
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as executor:
+            digests = executor.map(lambda rel: file_sha256(dataset_dir / rel), to_hash)
+            for rel, digest in zip(to_hash, digests):
+                state[rel] = dict(stamps[rel], digest=digest)
+        # keep entries of other files (e.g. a previous run with a different files= subset)
+        write_state(state_path, dict(read_state(state_path), **{rel: state[rel] for rel in to_hash}))
+
+    mismatched = [rel for rel in stamps if state[rel]['digest'] != expected[rel]]
+    return Verification(checked=len(stamps), rehashed=len(to_hash), missing=missing, mismatched=mismatched)
+
+
+def require_verified_dataset(dataset_dir, allow_missing=True, workers=None, files=None):
+    """verify_dataset, raising DatasetIntegrityError on mismatched (or, unless allowed, missing) files."""
+    result = verify_dataset(dataset_dir, workers=workers, files=files)
+    problems = ['digest mismatch: ' + rel for rel in result.mismatched]
+    if not allow_missing:
+        problems += ['missing: ' + rel for rel in result.missing]
+    if problems:
+        raise DatasetIntegrityError('dataset verification failed for {} file(s): {}'.format(
+            len(problems), ', '.join(problems[:5])))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify the dataset files against SHA256SUMS.txt.')
+    parser.add_argument('--dataset-dir', default=str(Path(__file__).resolve().parent),
+                        help='folder with SHA256SUMS.txt')
+    parser.add_argument('--workers', type=int, default=None, help='number of hashing threads')
+    parser.add_argument('--full', action='store_true', help='ignore the state file and rehash every file')
+    parser.add_argument('--require-all', action='store_true', help='treat missing files as failures')
+    args = parser.parse_args()
+
+    t_start = time()
+    result = verify_dataset(args.dataset_dir, workers=args.workers, full=args.full)
+    for rel in result.mismatched:
+        print('FAILED: ' + rel)
+    for rel in result.missing:
+        print('MISSING: ' + rel)
+    print('{} files checked ({} rehashed), {} mismatched, {} missing in {:.1f}s'.format(
+        result.checked, result.rehashed, len(result.mismatched), len(result.missing), time() - t_start))
+    return 1 if result.mismatched or (args.require_all and result.missing) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())